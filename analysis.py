@@ -1,6 +1,6 @@
-import tokenize
-from io import BytesIO
+from typing import Callable, NamedTuple, Optional
 import math
+from lexers import NAME, NUMBER, OP, TAG, python_lexer, java_lexer, javascript_lexer, html_lexer
 
 python_keywords = [
     'if', 'elif', 'else',
@@ -40,137 +40,178 @@ html_keywords = [
 ]
 
 
-def calculate_cyclomatic_complexity(patch, filename):
-    try:
-        code = parse_github_patch(patch)
-        file_extension = filename.split(".")[-1]
-        keywords = []
-
-        match file_extension:
-            case "py":
-                keywords += python_keywords
-            case "java":
-                keywords += java_keywords
-            case "js":
-                keywords += javascript_keywords
-            case "ts":
-                keywords += javascript_keywords
-            case "html":
-                keywords += html_keywords
-            case _:
-                return None
-
-        complexity = 1
-
-        tokens = tokenize.tokenize(BytesIO(code.encode('utf-8')).readline)
-        for token in tokens:
-            if token.type == tokenize.NAME and token.string in keywords:
-                complexity += 1
-        return complexity
-    except:
-        return None
+python_reserved = frozenset({
+    'def', 'if', 'elif', 'else', 'while', 'for', 'return', 'in', 'range', 'pass', 'break', 'continue', 'True', 'False',
+    'None', 'assert', 'async', 'await', 'with', 'from', 'import', 'try', 'except', 'finally', 'raise', 'class',
+    'global', 'nonlocal', 'lambda', 'yield', 'del', 'and', 'or', 'not', 'is', 'as'
+})
 
+java_reserved = frozenset({
+    'abstract', 'assert', 'boolean', 'break', 'byte', 'case', 'catch', 'char', 'class', 'const', 'continue',
+    'default', 'do', 'double', 'else', 'enum', 'extends', 'final', 'finally', 'float', 'for', 'if', 'goto',
+    'implements', 'import', 'instanceof', 'int', 'interface', 'long', 'native', 'new', 'package', 'private',
+    'protected', 'public', 'return', 'short', 'static', 'strictfp', 'super', 'switch', 'synchronized', 'this',
+    'throw', 'throws', 'transient', 'try', 'void', 'volatile', 'while'
+})
 
-def calculate_lines_to_comments_ratio(patch, filename):
+javascript_reserved = frozenset({
+    'break', 'case', 'catch', 'class', 'const', 'continue', 'debugger', 'default', 'delete', 'do', 'else', 'export',
+    'extends', 'finally', 'for', 'function', 'if', 'import', 'in', 'instanceof', 'new', 'return', 'super', 'switch',
+    'this', 'throw', 'try', 'typeof', 'var', 'void', 'while', 'with', 'yield'
+})
+
+# the regex lexers emit `else if` as one token, which is a keyword rather than an operand
+java_reserved = java_reserved | {'else if'}
+javascript_reserved = javascript_reserved | {'else if'}
+
+# operators that only structure the code and are left out of the Halstead vocabulary
+halstead_excluded_operators = frozenset({"(", ")", ":", ","})
+
+
+class LanguageTable(NamedTuple):
+    lexer: Callable
+    decision_keywords: frozenset
+    comment_prefixes: tuple
+    # None for languages without a maintainability index
+    halstead_excluded: Optional[frozenset]
+
+
+LANGUAGE_TABLES = {}
+
+
+def register_language(extensions, lexer, decision_keywords, comment_prefixes, halstead_excluded=None):
+    # Adding a language is a lexer yielding (kind, string) tokens plus its keyword and comment tables
+    table = LanguageTable(lexer, frozenset(decision_keywords), tuple(comment_prefixes),
+                          frozenset(halstead_excluded) if halstead_excluded is not None else None)
+    for extension in extensions:
+        LANGUAGE_TABLES[extension] = table
+    return table
+
+
+register_language(["py"], python_lexer, python_keywords, ["#", "'''", '"""'], python_reserved)
+register_language(["java"], java_lexer, java_keywords, ["//", "/*"], java_reserved)
+register_language(["js", "ts"], javascript_lexer, javascript_keywords, ["//", "/*"], javascript_reserved)
+register_language(["html"], html_lexer, html_keywords, ["<!--"])
+
+
+class PatchMetrics(NamedTuple):
+    complexity: Optional[int] = None
+    operators: Optional[int] = None
+    operands: Optional[int] = None
+    halstead_volume: Optional[float] = None
+    loc: Optional[int] = None
+    comment_lines: Optional[int] = None
+    ltc_ratio: Optional[float] = None
+    maintain_index: Optional[float] = None
+
+
+def get_language_table(filename):
+    return LANGUAGE_TABLES.get(filename.split(".")[-1])
+
+
+def analyze_patch(patch, filename):
+    # Computes every metric for one file from a single read of the added lines and a single tokenize pass.
+    # Metrics that can't be computed (unsupported language, untokenizable code, too few lines) are None.
+    table = get_language_table(filename)
+    if table is None or patch is None:
+        return PatchMetrics()
+
+    code = parse_github_patch(patch)
+
+    lines = code.split('\n')
+    comment_lines = sum(1 for line in lines if line.strip().startswith(table.comment_prefixes))
+    ltc_ratio = round(comment_lines / len(lines), 2) if len(lines) > 2 else None
+
+    complexity = None
+    operators = operands = None
+    halstead_volume = None
     try:
-        code = parse_github_patch(patch)
-        file_extension = filename.split(".")[-1]
-        comment_identifiers = []
-
-        match file_extension:
-            case "py":
-                comment_identifiers += ["#", "'''", '"""']
-            case "java":
-                comment_identifiers += ["//", "/*"]
-            case "js":
-                comment_identifiers += ["//", "/*"]
-            case "ts":
-                comment_identifiers += ["//", "/*"]
-            case "html":
-                comment_identifiers += ["<!--"]
-            case _:
-                return None
-
-        lines = code.split('\n')
-        total_lines = len(lines)
-        comment_lines = sum(
-            1 for line in lines if any(line.strip().startswith(comment) for comment in comment_identifiers))
-
-        if total_lines <= 2:
-            return None
-        else:
-            return round(comment_lines / total_lines, 2)
+        complexity, operator_set, operand_set = _scan_tokens(code, table)
+        if table.halstead_excluded is not None:
+            operators, operands = len(operator_set), len(operand_set)
+            halstead_volume = _halstead_volume(operators, operands)
     except Exception:
-        return None
+        pass
 
+    loc = len(code.splitlines())
+    maintain_index = _maintainability_index(halstead_volume, complexity, loc)
 
-def calculate_halstead_volume(code, excluded_keywords):
+    return PatchMetrics(complexity, operators, operands, halstead_volume, loc, comment_lines, ltc_ratio,
+                        maintain_index)
+
+
+def _scan_tokens(code, table):
+    decision_keywords = table.decision_keywords
+    excluded = table.halstead_excluded or frozenset()
+    complexity = 1
     operators = set()
     operands = set()
 
-    excluded_strings = {"(", ")", ":", ","}
+    for kind, string in table.lexer(code):
+        if kind == NAME:
+            if string in decision_keywords:
+                complexity += 1
+            if string not in excluded:
+                operands.add(string)
+        elif kind == NUMBER:
+            if string not in excluded:
+                operands.add(string)
+        elif kind == OP:
+            if string in decision_keywords:
+                complexity += 1
+            if string not in halstead_excluded_operators:
+                operators.add(string)
+        elif kind == TAG and string in decision_keywords:
+            complexity += 1
 
-    tokens = tokenize.tokenize(BytesIO(code.encode('utf-8')).readline)
-    for token in tokens:
-        if (token.type == tokenize.OP) and token.string not in excluded_strings:
-            operators.add(token.string)
-        elif (token.type == tokenize.NAME or token.type == tokenize.NUMBER) and token.string not in excluded_keywords:
-            operands.add(token.string)
+    return complexity, operators, operands
 
-    n1 = len(operators)
-    n2 = len(operands)
 
+def _halstead_volume(n1, n2):
     volume = (n1 + n2) * math.log2(n1 + n2) if n1 + n2 > 0 else 0
     return round(volume, 1)
 
 
-def calculate_maintainability_index(patch, filename, cc):
+def _maintainability_index(hv, cc, loc):
+    if hv is None or cc is None:
+        return None
     try:
-        code = parse_github_patch(patch)
-        file_extension = filename.split(".")[-1]
-        excluded_keywords = {}
-
-        match file_extension:
-            case "py":
-                excluded_keywords = {'def', 'if', 'elif', 'else', 'while', 'for', 'return', 'in', 'range', 'pass',
-                                     'break', 'continue', 'True', 'False', 'None', 'assert', 'async', 'await', 'with',
-                                     'from', 'import', 'try', 'except', 'finally', 'raise', 'class', 'global',
-                                     'nonlocal', 'lambda', 'yield', 'del', 'and', 'or', 'not', 'is', 'as', 'lambda'}
-            case "java":
-                excluded_keywords = {'abstract', 'assert', 'boolean', 'break', 'byte', 'case', 'catch', 'char',
-                                     'class', 'const', 'continue', 'default', 'do', 'double', 'else', 'enum',
-                                     'extends', 'final', 'finally', 'float', 'for', 'if', 'goto', 'implements',
-                                     'import', 'instanceof', 'int', 'interface', 'long', 'native', 'new', 'package',
-                                     'private', 'protected', 'public', 'return', 'short', 'static', 'strictfp',
-                                     'super', 'switch', 'synchronized', 'this', 'throw', 'throws', 'transient', 'try',
-                                     'void', 'volatile', 'while'}
-            case "js":
-                excluded_keywords = {'break', 'case', 'catch', 'class', 'const', 'continue', 'debugger', 'default',
-                                     'delete', 'do', 'else', 'export', 'extends', 'finally', 'for', 'function', 'if',
-                                     'import', 'in', 'instanceof', 'new', 'return', 'super', 'switch', 'this', 'throw',
-                                     'try', 'typeof', 'var', 'void', 'while', 'with', 'yield'}
-            case "ts":
-                excluded_keywords = {'break', 'case', 'catch', 'class', 'const', 'continue', 'debugger', 'default',
-                                     'delete', 'do', 'else', 'export', 'extends', 'finally', 'for', 'function', 'if',
-                                     'import', 'in', 'instanceof', 'new', 'return', 'super', 'switch', 'this', 'throw',
-                                     'try', 'typeof', 'var', 'void', 'while', 'with', 'yield'}
-
-        if len(excluded_keywords) == 0:
-            return None
-
-        hv = calculate_halstead_volume(code, excluded_keywords)
-        loc = len(code.splitlines())
-
-        mi = 171 - 5.2 * math.log(hv) - 0.23 * cc - 16.2 * math.log(loc)
-        return round(mi, 1)
-
-    except Exception:
+        return round(171 - 5.2 * math.log(hv) - 0.23 * cc - 16.2 * math.log(loc), 1)
+    except ValueError:
         return None
 
 
+def calculate_cyclomatic_complexity(patch, filename):
+    return analyze_patch(patch, filename).complexity
+
+
+def calculate_lines_to_comments_ratio(patch, filename):
+    return analyze_patch(patch, filename).ltc_ratio
+
+
+def calculate_halstead_volume(code, excluded_keywords):
+    table = LanguageTable(python_lexer, frozenset(), (), frozenset(excluded_keywords))
+    _, operators, operands = _scan_tokens(code, table)
+    return _halstead_volume(len(operators), len(operands))
+
+
+def calculate_maintainability_index(patch, filename, cc):
+    metrics = analyze_patch(patch, filename)
+    return _maintainability_index(metrics.halstead_volume, cc, metrics.loc)
+
+
 def parse_github_patch(patch_str):
     parsed_lines = []
     for line in patch_str.split('\n'):
         if line.startswith('+'):
             parsed_lines.append(line[1:])
     return '\n'.join(parsed_lines)
+
+
+def analyse_files(files):
+    # Computes the stored metrics for a batch of (filename, patch) pairs; used as a single process-pool task
+    results = []
+    for filename, patch in files:
+        metrics = analyze_patch(patch, filename)
+        results.append((metrics.complexity, metrics.maintain_index, metrics.ltc_ratio))
+    return results
@@ -0,0 +1,56 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+from analysis import analyse_files
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", os.cpu_count() or 1))
+ANALYSIS_CHUNK_SIZE = int(os.getenv("ANALYSIS_CHUNK_SIZE", 64))
+
+
+class AnalysisExecutor:
+    # Patch analysis is CPU bound tokenizer work, so it runs in worker processes rather than on the event loop.
+    # Files are sent in chunks so one task's pickling cost is spread over many patches.
+    def __init__(self, workers: int = ANALYSIS_WORKERS, chunk_size: int = ANALYSIS_CHUNK_SIZE):
+        self.workers = workers
+        self.chunk_size = max(1, chunk_size)
+        self._executor = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+
+    async def analyse(self, files: List[Tuple[str, str]]):
+        if not files:
+            return []
+        if self._executor is None:
+            return analyse_files(files)
+
+        loop = asyncio.get_running_loop()
+        chunks = [files[i:i + self.chunk_size] for i in range(0, len(files), self.chunk_size)]
+        results = await asyncio.gather(*(loop.run_in_executor(self._executor, analyse_files, chunk)
+                                         for chunk in chunks))
+        return [result for chunk in results for result in chunk]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+_executor: Optional[AnalysisExecutor] = None
+
+
+def get_analysis_executor():
+    global _executor
+    if _executor is None:
+        _executor = AnalysisExecutor()
+    return _executor
+
+
+def start_analysis_executor(workers: int = ANALYSIS_WORKERS):
+    global _executor
+    _executor = AnalysisExecutor(workers)
+    return _executor
+
+
+def shutdown_analysis_executor():
+    global _executor
+    if _executor is not None:
+        executor, _executor = _executor, None
+        executor.shutdown()
@@ -1,20 +1,26 @@
 # auth_routes.py
+import os
 from fastapi import APIRouter, HTTPException
 import database
 from models import UserRegistration, Token, UserLogin
-from .auth_utils import AuthHandler
-import httpx
+from utils import TTLCache
+from .auth_utils import auth_handler
+from .password_hasher import get_password_hasher
+from github.github_client import get_github_client
+
+CONNECTION_CACHE_TTL = float(os.getenv("CONNECTION_CACHE_TTL", 60))
 
 auth_router = APIRouter(
     prefix='/auth',
     tags=['authorisation']
 )
-auth_handler = AuthHandler()
+# (user id, github token) -> True for tokens GitHub recently accepted; a replaced token misses on its own
+connection_cache = TTLCache(CONNECTION_CACHE_TTL)
 
 
 @auth_router.post("/register", response_model=Token)
 async def register(user_details: UserRegistration):
-    user_details.password = auth_handler.getPasswordHash(user_details.password)
+    user_details.password = await get_password_hasher().hash(user_details.password)
     user_id = database.register(user_details)
 
     access_token = auth_handler.encodeToken(user_id)
@@ -28,8 +34,11 @@ async def login(user_details: UserLogin):
 
     if user is None:
         raise HTTPException(status_code=401, detail='Invalid Email/Password')
-    if not auth_handler.verifyPassword(user_details.password, user[2]):
+    verified, new_hash = await get_password_hasher().verify_and_update(user_details.password, user[2])
+    if not verified:
         raise HTTPException(status_code=401, detail='Invalid Email/Password')
+    if new_hash:
+        database.updatePasswordHash(user[0], new_hash)
 
     access_token = auth_handler.encodeToken(user[0])
     refresh_token = auth_handler.encodeToken(user[0], 10800)
@@ -48,19 +57,17 @@ async def validateToken(token: Token):
 
     if token is None:
         return False
+    elif connection_cache.get((user_id, token)):
+        return True
     else:
-        headers = {"Authorization": f"Bearer {token}"}
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"https://api.github.com/issues",
-                headers=headers
-            )
-
-            if response.status_code != 200:
-                database.removeGitHubToken(user_id)
-                return False
-            else:
-                return True
+        response = await get_github_client().get("/issues", token)
+
+        if response.status_code != 200:
+            database.removeGitHubToken(user_id)
+            return False
+        else:
+            connection_cache.set((user_id, token), True)
+            return True
 
 
 @auth_router.post("/refresh-access-token", response_model=Token)
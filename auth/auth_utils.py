@@ -3,12 +3,24 @@ from fastapi import HTTPException, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
+from utils import TTLCache
+import hashlib
 import os
+import time
+
+CLAIMS_CACHE_SIZE = int(os.getenv("CLAIMS_CACHE_SIZE", 4096))
+# bcrypt cost for new hashes; hashes made with any other cost are replaced on the user's next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
 
 
 class AuthHandler:
     security = HTTPBearer()
-    pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto")
+    pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+    def __init__(self):
+        self.secret = None
+        # verified claims by token digest, each kept until the token's own exp
+        self.claims_cache = TTLCache(ttl=0, max_entries=CLAIMS_CACHE_SIZE)
 
     def getPasswordHash(self, password):
         return self.pwd_context.hash(password)
@@ -16,8 +28,13 @@ class AuthHandler:
     def verifyPassword(self, plainPassword, hashedPassword):
         return self.pwd_context.verify(plainPassword, hashedPassword)
 
+    def verifyAndUpdatePassword(self, plainPassword, hashedPassword):
+        return self.pwd_context.verify_and_update(plainPassword, hashedPassword)
+
     def getSecret(self):
-        return os.getenv("JWT_SECRET")
+        if self.secret is None:
+            self.secret = os.getenv("JWT_SECRET")
+        return self.secret
 
     def encodeToken(self, userId, expiration_minutes=20):
         payload = {
@@ -32,9 +49,18 @@ class AuthHandler:
             algorithm='HS256'
         )
 
+    def verifyToken(self, token):
+        digest = hashlib.sha256(token.encode()).digest()
+        payload = self.claims_cache.get(digest)
+        if payload is None:
+            payload = jwt.decode(token, self.getSecret(), algorithms=['HS256'])
+            if 'exp' in payload:
+                self.claims_cache.set(digest, payload, ttl=payload['exp'] - time.time())
+        return payload
+
     def decodeToken(self, token, boolResp=False):
         try:
-            payload = jwt.decode(token, self.getSecret(), algorithms=['HS256'])
+            payload = self.verifyToken(token)
             if boolResp:
                 return True
             return payload['sub']
@@ -49,3 +75,11 @@ class AuthHandler:
 
     def authWrapper(self, auth: HTTPAuthorizationCredentials = Security(security)):
         return self.decodeToken(auth.credentials)
+
+
+# Shared by every router. Routers and routes both depend on get_current_user, which FastAPI resolves once per request.
+auth_handler = AuthHandler()
+
+
+def get_current_user(auth: HTTPAuthorizationCredentials = Security(AuthHandler.security)):
+    return auth_handler.decodeToken(auth.credentials)
@@ -0,0 +1,65 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from fastapi import HTTPException
+from .auth_utils import auth_handler
+
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", os.cpu_count() or 1))
+# hash/verify calls allowed to wait for a worker before new ones are turned away
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", 32))
+PASSWORD_RETRY_AFTER = 1
+
+
+class PasswordHasher:
+    # bcrypt is deliberately slow and releases the GIL while it works, so it runs on a small thread pool instead of
+    # the event loop. Once max_pending calls are in flight further ones get a 503 rather than an ever-growing queue.
+    def __init__(self, workers: int = PASSWORD_WORKERS, max_pending: int = PASSWORD_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    async def run(self, function, *args):
+        if self.pending >= self.max_pending:
+            raise HTTPException(status_code=503, detail="Too many sign-in attempts in progress, try again shortly",
+                                headers={"Retry-After": str(PASSWORD_RETRY_AFTER)})
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str):
+        return await self.run(auth_handler.getPasswordHash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str):
+        # (matches, new hash or None); a new hash means the stored one was made with a different bcrypt cost
+        return await self.run(auth_handler.verifyAndUpdatePassword, password, hashed_password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+_hasher: Optional[PasswordHasher] = None
+
+
+def get_password_hasher():
+    global _hasher
+    if _hasher is None:
+        _hasher = PasswordHasher()
+    return _hasher
+
+
+def start_password_hasher(workers: int = PASSWORD_WORKERS):
+    global _hasher
+    _hasher = PasswordHasher(workers)
+    return _hasher
+
+
+def shutdown_password_hasher():
+    global _hasher
+    if _hasher is not None:
+        hasher, _hasher = _hasher, None
+        hasher.shutdown()
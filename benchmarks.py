@@ -0,0 +1,165 @@
+# Micro-benchmarks for request hot paths. Run with: python benchmarks.py [name ...]
+import asyncio
+import sys
+import tempfile
+import time
+import httpx
+import jwt
+from fastapi.testclient import TestClient
+from auth.auth_utils import AuthHandler
+from auth import password_hasher
+
+BENCHMARKS = {}
+BENCHMARK_SECRET = "benchmark-secret"
+
+
+def benchmark(function):
+    BENCHMARKS[function.__name__.removeprefix("bench_")] = function
+    return function
+
+
+def measure(function, number=1000, repeat=5):
+    # best of repeat runs, in seconds per call
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+
+def report(name, seconds):
+    print(f"{name:<48} {seconds * 1e6:>10.1f} us/call")
+
+
+def app_client():
+    from main import app
+    from auth.auth_utils import auth_handler
+
+    auth_handler.secret = BENCHMARK_SECRET
+    return TestClient(app), auth_handler
+
+
+@benchmark
+def bench_auth():
+    handler = AuthHandler()
+    handler.secret = BENCHMARK_SECRET
+    token = handler.encodeToken(1)
+
+    report("auth: jwt.decode", measure(lambda: jwt.decode(token, BENCHMARK_SECRET, algorithms=["HS256"])))
+    report("auth: decodeToken with cached claims", measure(lambda: handler.decodeToken(token)))
+
+    # the same tiny route with and without the auth dependency; the difference is the per-request auth cost
+    client, shared_handler = app_client()
+    headers = {"Authorization": f"Bearer {shared_handler.encodeToken(1)}"}
+    report("auth: GET / (no auth)", measure(lambda: client.get("/"), number=200))
+    report("auth: GET /github/cache-stats", measure(lambda: client.get("/github/cache-stats", headers=headers),
+                                                    number=200))
+
+
+class InlineHasher(password_hasher.PasswordHasher):
+    # the old behaviour: bcrypt runs on the event loop and blocks every other request while it works
+    async def run(self, function, *args):
+        return function(*args)
+
+
+async def _login_burst(app, logins):
+    # fires the logins together and probes GET / meanwhile; returns (burst seconds, worst probe latency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        credentials = {"email": "benchmark@example.com", "password": "benchmark-password"}
+        probes = []
+
+        async def probe():
+            while True:
+                started = time.perf_counter()
+                await client.get("/")
+                probes.append(time.perf_counter() - started)
+                await asyncio.sleep(0.005)
+
+        prober = asyncio.create_task(probe())
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(client.post("/auth/login", json=credentials) for _ in range(logins)))
+        elapsed = time.perf_counter() - started
+        prober.cancel()
+
+    assert all(response.status_code == 200 for response in responses)
+    return elapsed, max(probes, default=elapsed)
+
+
+@benchmark
+def bench_login(logins=8):
+    import database
+    import models
+
+    client, handler = app_client()
+    with tempfile.TemporaryDirectory() as directory:
+        database.init_pool(f"{directory}/benchmark.db")
+        database.create_db()
+        database.register(models.UserRegistration(email="benchmark@example.com", forename="Benchmark",
+                                                  password=handler.getPasswordHash("benchmark-password")))
+
+        hashers = (("inline bcrypt", InlineHasher(workers=1)), ("worker pool", password_hasher.PasswordHasher()))
+        for name, hasher in hashers:
+            password_hasher._hasher = hasher
+            elapsed, worst_probe = asyncio.run(_login_burst(client.app, logins))
+            hasher.shutdown()
+            print(f"login: {logins} concurrent logins, {name:<14} {logins / elapsed:>8.1f} logins/s, "
+                  f"worst GET / {worst_probe * 1000:.0f} ms")
+
+        password_hasher._hasher = None
+        database.close_pool()
+
+
+@benchmark
+def bench_analysis_writes(sizes=(2000, 4000, 8000)):
+    # one author's rows through the batch writer; with the rollup triggers this should grow linearly with size
+    import database
+
+    for size in sizes:
+        rows = [("owner", "repo", f"{i // 3:040x}", "author", f"file{i % 3}.py", i % 60, 40.0 + i % 50, 0.2,
+                 f"2024-01-{1 + i % 28:02d} 10:00:00") for i in range(size)]
+        with tempfile.TemporaryDirectory() as directory:
+            database.init_pool(f"{directory}/benchmark.db")
+            database.create_db()
+            started = time.perf_counter()
+            database.insert_commit_complexity_batch(rows)
+            report(f"writes: {size} rows, one author", (time.perf_counter() - started) / size)
+            database.close_pool()
+
+
+@benchmark
+def bench_analysis_payload(files=5000):
+    import gzip
+    import json
+    from fastapi.encoders import jsonable_encoder
+    import responses
+    from github.github_routes import structure_analysis_row, columnar_analysis
+
+    grades = "ABCF"
+    rows = [("owner", "repo", f"{i:040x}", f"author{i % 25}", f"src/module{i % 400}/file{i % 7}.py", i % 60,
+             40.0 + i % 50, (i % 10) / 10, "2024-01-01 10:00:00", i, grades[i % 4], "AB"[i % 2], grades[(i + 1) % 4])
+            for i in range(files)]
+
+    def current():
+        # FastAPI's default path: jsonable_encoder, then json.dumps inside JSONResponse
+        return json.dumps(jsonable_encoder([structure_analysis_row(row) for row in rows]), ensure_ascii=False,
+                          allow_nan=False, separators=(",", ":")).encode()
+
+    def columnar():
+        return responses.dump_json(columnar_analysis(rows))
+
+    encoder = "orjson" if responses.orjson is not None else "json"
+    for name, encode in (("rows + jsonable_encoder/json", current), (f"columnar + {encoder}", columnar)):
+        body = encode()
+        sizes = f"{len(body) / 1024:.0f} KiB, gzip {len(gzip.compress(body, responses.GZIP_LEVEL)) / 1024:.0f} KiB"
+        if responses.brotli is not None:
+            sizes += f", br {len(responses.compress(body, 'br')) / 1024:.0f} KiB"
+        report(f"payload: {files} files, {name}", measure(encode, number=5, repeat=3))
+        print(f"{'':<8}{sizes}")
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or list(BENCHMARKS):
+        BENCHMARKS[name]()
@@ -1,155 +1,345 @@
-# database.py
 import sqlite3
+import base64
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from fastapi import HTTPException
 import models
-from utils import encryptToken, decrypt_token
+import migrations
+from rollups import complexity_grade_sql, maintainability_grade_sql, comment_ratio_grade_sql, GRADE_LETTERS, \
+    COMMENT_GRADE_LETTERS, rebuild_rollups
+from utils import encryptToken, decrypt_token, TTLCache
 from datetime import datetime
 
 DB_PATH = "example.db"
-
-
-def connect_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    return conn, cursor
-
-
-def close_db(conn):
-    conn.commit()
-    conn.close()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+ANALYSIS_BATCH_SIZE = int(os.getenv("ANALYSIS_BATCH_SIZE", 500))
+ANALYSIS_PAGE_SIZE = 100
+GIT_TOKEN_CACHE_TTL = float(os.getenv("GIT_TOKEN_CACHE_TTL", 300))
+ANALYSIS_MAX_PAGE_SIZE = 500
+
+# sort keys accepted from clients, mapped to the indexed column they order by
+ANALYSIS_SORT_COLUMNS = {
+    "complexity": "complexity",
+    "maintainability": "maintain_index",
+    "maintain_index": "maintain_index",
+    "commentRatio": "ltc_ratio",
+    "ltc_ratio": "ltc_ratio",
+    "date": "commit_date",
+    "commit_date": "commit_date",
+}
+
+# complexity grade filters as index-friendly ranges, mirroring utils.grade_complexity
+COMPLEXITY_GRADE_RANGES = {
+    "A": "complexity <= 10",
+    "B": "complexity > 10 AND complexity < 21",
+    "C": "complexity > 20 AND complexity < 41",
+    "F": "complexity >= 41",
+}
+
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",  # negative value is in KiB, so ~16MB per connection
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+class ConnectionPool:
+    def __init__(self, path: str, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._checked_out = 0
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        started = time.perf_counter()
+        conn = None
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if len(self._connections) < self.size:
+                    conn = self._connect()
+                    self._connections.append(conn)
+
+        if conn is None:
+            try:
+                conn = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise HTTPException(status_code=503, detail="Database connection pool exhausted")
+
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._checked_out += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def release(self, conn):
+        with self._lock:
+            self._checked_out -= 1
+        self._idle.put(conn)
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+        for conn in connections:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "path": self.path,
+                "size": self.size,
+                "open": len(self._connections),
+                "checkedOut": self._checked_out,
+                "checkouts": self._checkouts,
+                "avgCheckoutWaitMs": round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0,
+                "maxCheckoutWaitMs": round(self._wait_max * 1000, 3),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+
+def init_pool(path: str = None, size: int = DB_POOL_SIZE):
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(path or DB_PATH, size)
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def get_pool_stats():
+    return get_pool().stats()
+
+
+@contextmanager
+def db_connection():
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn, conn.cursor()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.release(conn)
+
+
+COMMIT_ANALYSIS_COLUMNS = ("repo_owner", "repo_name", "commit_sha", "author", "filename", "complexity",
+                           "maintain_index", "ltc_ratio", "commit_date")
+
+USER_ID_BY_EMAIL_QUERY = "SELECT id FROM users WHERE email=?"
+USER_BY_EMAIL_QUERY = "SELECT * FROM users WHERE email=?"
+USER_BY_ID_QUERY = "SELECT id, email, forename FROM users WHERE id=?"
+GIT_TOKEN_QUERY = "SELECT token FROM githubTokens WHERE user_id=?"
+LAST_ANALYSED_QUERY = "SELECT last_updated FROM repoLastAnalysed WHERE repo_name=? AND repo_owner=?"
+REPO_ANALYSIS_QUERY = "SELECT * FROM commitFileAnalysis WHERE repo_name=? AND repo_owner=? ORDER BY {orderBy} DESC"
+ANALYSIS_ROW_COLUMNS = (f"*, rowid, {complexity_grade_sql('complexity')} AS complexity_grade, "
+                        f"{comment_ratio_grade_sql('ltc_ratio')} AS comment_grade, "
+                        f"{maintainability_grade_sql('maintain_index')} AS maintainability_grade")
+
+
+def _summary_average_sql(column: str):
+    return f"COALESCE(ROUND(SUM({column}_sum) * 1.0 / SUM({column}_files), 2), 0)"
+
+
+# repoSummary holds at most one row per repository; aggregating over it still yields zeros for unanalysed repositories
+REPO_ANALYSIS_SUMMARY_QUERY = f"""
+    SELECT
+        COALESCE(SUM(files), 0) AS files,
+        COALESCE(SUM(complexity_files), 0) AS complexity_files,
+        {_summary_average_sql('complexity')} AS avg_complexity,
+        {complexity_grade_sql(_summary_average_sql('complexity'))} AS complexity_grade,
+        COALESCE(SUM(ltc_ratio_files), 0) AS ltc_ratio_files,
+        {_summary_average_sql('ltc_ratio')} AS avg_ltc_ratio,
+        {comment_ratio_grade_sql(_summary_average_sql('ltc_ratio'))} AS comment_grade,
+        COALESCE(SUM(maintain_index_files), 0) AS maintain_index_files,
+        {_summary_average_sql('maintain_index')} AS avg_maintain_index,
+        {maintainability_grade_sql(_summary_average_sql('maintain_index'))} AS maintainability_grade,
+        {", ".join(f"COALESCE(SUM({name}_{letter.lower()}), 0) AS {name}_{letter.lower()}"
+                   for name, letters in (("complexity", GRADE_LETTERS), ("comment", COMMENT_GRADE_LETTERS),
+                                         ("maintainability", GRADE_LETTERS))
+                   for letter in letters)}
+    FROM repoSummary
+    WHERE repo_owner=? AND repo_name=?
+"""
+SYNC_WATERMARK_QUERY = "SELECT head_sha FROM repoSyncWatermark WHERE repo_owner=? AND repo_name=? AND branch=?"
+SEEN_COMMITS_QUERY = "SELECT sha FROM repoSeenCommits WHERE repo_owner=? AND repo_name=?"
+REPO_CONTRIBUTORS_QUERY = "SELECT DISTINCT author FROM commitFileAnalysis WHERE repo_name=? AND repo_owner=?"
+GITHUB_RESPONSE_CACHE_QUERY = ("SELECT etag, last_modified, body, headers FROM githubResponseCache WHERE user_id=? AND "
+                               "url=?")
+COMMIT_DETAILS_QUERY = "SELECT payload FROM commitDetailsStore WHERE repo_owner=? AND repo_name=? AND sha=?"
+CONTRIBUTOR_DATA_QUERY = """
+    SELECT NULLIF(day, '') AS commit_date, commits AS commit_count
+    FROM contributorDaily
+    WHERE repo_name=? AND repo_owner=? AND author=? AND files > 0
+    ORDER BY day ASC
+"""
+# each month is dated by its latest day with analysed files, read from the daily rollup
+CONTRIBUTOR_ANALYSIS_QUERY = """
+    SELECT
+        MAX(NULLIF(daily.day, '')) AS commit_date,
+        monthly.maintain_index_sum * 1.0 / monthly.maintain_index_files AS avg_maintain_index,
+        monthly.ltc_ratio_sum * 1.0 / monthly.ltc_ratio_files AS avg_ltc_ratio,
+        monthly.complexity_sum * 1.0 / monthly.complexity_files AS avg_complexity
+    FROM contributorMonthly AS monthly
+    JOIN contributorDaily AS daily
+        ON daily.repo_owner = monthly.repo_owner
+        AND daily.repo_name = monthly.repo_name
+        AND daily.author = monthly.author
+        AND daily.day >= monthly.month
+        AND daily.day < monthly.month || '-99'
+        AND daily.files > 0
+    WHERE
+        monthly.repo_name = ?
+        AND monthly.repo_owner = ?
+        AND monthly.author = ?
+        AND monthly.files > 0
+    GROUP BY monthly.month
+    ORDER BY commit_date ASC
+"""
 
 
 def create_db():
-    conn, cursor = connect_db()
-
-    cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email TEXT NOT NULL,
-                password TEXT NOT NULL,
-                forename TEXT
-            )
-        """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS githubTokens (
-                user_id INTEGER UNIQUE,
-                token TEXT                
-            )
-        """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS repoLastAnalysed (
-                repo_owner TEXT,
-                repo_name TEXT,
-                last_updated DATETIME,
-                PRIMARY KEY (repo_owner, repo_name)
-            )
-        """)
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS commitFileAnalysis (
-            repo_owner TEXT,
-            repo_name TEXT,
-            commit_sha TEXT,
-            author TEXT,
-            filename TEXT,
-            complexity INTEGER,
-            maintain_index FLOAT,
-            ltc_ratio FLOAT,
-            commit_date DATETIME,
-            PRIMARY KEY (commit_sha, filename, repo_owner, repo_name)
-        )
-    ''')
-
-    close_db(conn)
+    with db_connection() as (conn, cursor):
+        migrations.migrate(conn)
 
 
 def register(user: models.UserRegistration):
-    conn, cursor = connect_db()
-    cursor.execute("SELECT id FROM users WHERE email=?", (user.email.lower(),))
-    existing_user = cursor.fetchone()
-
-    if existing_user:
-        close_db(conn)
-        raise HTTPException(status_code=400, detail="Email already registered")
-
-    try:
-        # Insert the new user
-        cursor.execute("INSERT INTO users (email, password, forename) VALUES (?, ?, ?)",
-                       (user.email.lower(), user.password, user.forename))
-        cursor.execute("SELECT id FROM users WHERE email=?", (user.email.lower(),))
-        user_id = cursor.fetchone()
-
-        close_db(conn)
-        return user_id[0]
-    except sqlite3.IntegrityError:
-        close_db(conn)
+    with db_connection() as (conn, cursor):
+        cursor.execute(USER_ID_BY_EMAIL_QUERY, (user.email.lower(),))
+        existing_user = cursor.fetchone()
+
+        if existing_user:
+            raise HTTPException(status_code=400, detail="Email already registered")
+
+        try:
+            # Insert the new user
+            cursor.execute("INSERT INTO users (email, password, forename) VALUES (?, ?, ?)",
+                           (user.email.lower(), user.password, user.forename))
+            cursor.execute(USER_ID_BY_EMAIL_QUERY, (user.email.lower(),))
+            user_id = cursor.fetchone()
+
+            return user_id[0]
+        except sqlite3.IntegrityError:
+            return None
 
 
 def login(user: models.UserLogin):
-    conn, cursor = connect_db()
-    cursor.execute("SELECT * FROM users WHERE email=?", (user.email.lower(),))
-    db_user = cursor.fetchone()
+    with db_connection() as (conn, cursor):
+        cursor.execute(USER_BY_EMAIL_QUERY, (user.email.lower(),))
+        return cursor.fetchone()
+
 
-    close_db(conn)
-    return db_user
+def updatePasswordHash(user_id: int, password_hash: str):
+    with db_connection() as (conn, cursor):
+        cursor.execute("UPDATE users SET password=? WHERE id=?", (password_hash, user_id))
 
 
 def getUser(user_id: int):
-    conn, cursor = connect_db()
-    cursor.execute("SELECT id, email, forename FROM users WHERE id=?", (user_id,))
-    db_user = cursor.fetchone()
+    with db_connection() as (conn, cursor):
+        cursor.execute(USER_BY_ID_QUERY, (user_id,))
+        return cursor.fetchone()
+
 
-    close_db(conn)
-    return db_user
+# decrypted tokens by user id, including users without one, so GitHub calls skip the query and the decrypt
+git_token_cache = TTLCache(GIT_TOKEN_CACHE_TTL)
+_NO_CACHED_TOKEN = object()
 
 
 def storeGitToken(token: str, user_id: str):
     encrypted_token = encryptToken(token)
     try:
-        conn, cursor = connect_db()
-        cursor.execute("INSERT INTO githubTokens (user_id, token) VALUES  (?, ?)", (user_id, encrypted_token))
-        close_db(conn)
+        with db_connection() as (conn, cursor):
+            cursor.execute("INSERT INTO githubTokens (user_id, token) VALUES  (?, ?)", (user_id, encrypted_token))
 
         return True
     except Exception:
         return False
+    finally:
+        git_token_cache.invalidate(str(user_id))
 
 
 def getGitToken(user_id: str):
-    try:
-        conn, cursor = connect_db()
-        cursor.execute("SELECT token FROM githubTokens WHERE user_id=?", (user_id,))
-        token = cursor.fetchone()
+    cached = git_token_cache.get(str(user_id), _NO_CACHED_TOKEN)
+    if cached is not _NO_CACHED_TOKEN:
+        return cached
 
-        close_db(conn)
+    try:
+        with db_connection() as (conn, cursor):
+            cursor.execute(GIT_TOKEN_QUERY, (user_id,))
+            token = cursor.fetchone()
 
-        if token:
-            return decrypt_token(token[0])
-        else:
-            return None
+        token = decrypt_token(token[0]) if token else None
     except Exception:
         raise HTTPException(status_code=400, detail="Unable to find Github access token")
 
+    git_token_cache.set(str(user_id), token)
+    return token
+
 
 def removeGitHubToken(user_id: str):
     try:
-        conn, cursor = connect_db()
-        cursor.execute("DELETE FROM githubTokens WHERE user_id=?", (user_id,))
-
-        close_db(conn)
+        with db_connection() as (conn, cursor):
+            cursor.execute("DELETE FROM githubTokens WHERE user_id=?", (user_id,))
     except Exception:
         raise HTTPException(status_code=500, detail="Unable to remove Github access token")
+    finally:
+        git_token_cache.invalidate(str(user_id))
 
 
 def getRepoLastAnalysedTime(repoName: str, repoOwner: str):
-    conn, cursor = connect_db()
-    cursor.execute("SELECT last_updated FROM repoLastAnalysed WHERE repo_name=? AND repo_owner=?",
-                   (repoName, repoOwner))
-    lastUpdated = cursor.fetchone()
-
-    close_db(conn)
+    with db_connection() as (conn, cursor):
+        cursor.execute(LAST_ANALYSED_QUERY, (repoName, repoOwner))
+        lastUpdated = cursor.fetchone()
 
     if lastUpdated:
         return lastUpdated[0]
@@ -157,23 +347,21 @@ def getRepoLastAnalysedTime(repoName: str, repoOwner: str):
 
 
 def setLastAnalysedTime(repoOwner: str, repoName: str):
-    conn, cursor = connect_db()
-    cursor.execute(
-        "INSERT INTO repoLastAnalysed (repo_owner, repo_name, last_updated) VALUES (?, ?, ?) ON CONFLICT(repo_owner, "
-        "repo_name) DO UPDATE SET last_updated = ?",
-        (repoOwner, repoName, datetime.now(), datetime.now()))
-
-    close_db(conn)
+    with db_connection() as (conn, cursor):
+        cursor.execute(
+            "INSERT INTO repoLastAnalysed (repo_owner, repo_name, last_updated) VALUES (?, ?, ?) ON CONFLICT(repo_owner, "
+            "repo_name) DO UPDATE SET last_updated = ?",
+            (repoOwner, repoName, datetime.now(), datetime.now()))
 
 
 def getRepoAnalysis(repo_owner, repo_name, orderBy='complexity'):
-    try:
-        conn, cursor = connect_db()
-        query = f"SELECT * FROM commitFileAnalysis WHERE repo_name=? AND repo_owner=? ORDER BY {orderBy} DESC"
-        cursor.execute(query, (repo_name, repo_owner))
-        analysis = cursor.fetchall()
+    if orderBy not in ANALYSIS_SORT_COLUMNS.values():
+        raise HTTPException(status_code=400, detail="Invalid sort column")
 
-        close_db(conn)
+    try:
+        with db_connection() as (conn, cursor):
+            cursor.execute(REPO_ANALYSIS_QUERY.format(orderBy=orderBy), (repo_name, repo_owner))
+            analysis = cursor.fetchall()
 
         if analysis:
             return analysis
@@ -182,6 +370,127 @@ def getRepoAnalysis(repo_owner, repo_name, orderBy='complexity'):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def encode_analysis_cursor(sort: str, value, rowid: int):
+    return base64.urlsafe_b64encode(json.dumps([sort, value, rowid]).encode()).decode()
+
+
+def decode_analysis_cursor(cursor: str, sort: str):
+    try:
+        cursor_sort, value, rowid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if cursor_sort != sort:
+        raise HTTPException(status_code=400, detail="Cursor does not match sort")
+    return value, rowid
+
+
+def analysis_page_queries(repo_owner: str,
+                          repo_name: str,
+                          limit: int = ANALYSIS_PAGE_SIZE,
+                          cursor: str = None,
+                          sort: str = "complexity",
+                          author: str = None,
+                          filename_prefix: str = None,
+                          grade: str = None,
+                          since: str = None,
+                          until: str = None):
+    # The (query, params) steps of one keyset page, run in order until the page is full. Past a non-NULL cursor the
+    # row value comparison (column, rowid) < (?, ?) is an index range on (repo_owner, repo_name, column), so deep pages
+    # cost the same as the first; it never matches NULLs, so the NULL tail that sorts last is a step of its own.
+    column = ANALYSIS_SORT_COLUMNS.get(sort)
+    if column is None:
+        raise HTTPException(status_code=400, detail="Invalid sort column")
+    if grade is not None and grade not in COMPLEXITY_GRADE_RANGES:
+        raise HTTPException(status_code=400, detail="Invalid grade")
+    limit = max(1, min(limit, ANALYSIS_MAX_PAGE_SIZE))
+
+    conditions = ["repo_owner = ?", "repo_name = ?"]
+    params = [repo_owner, repo_name]
+
+    if author is not None:
+        conditions.append("author = ?")
+        params.append(author)
+    if filename_prefix:
+        conditions.append("substr(filename, 1, ?) = ?")
+        params += [len(filename_prefix), filename_prefix]
+    if grade is not None:
+        conditions.append(COMPLEXITY_GRADE_RANGES[grade])
+    if since is not None:
+        conditions.append("commit_date >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("commit_date < ?")
+        params.append(until)
+
+    steps = [([], [])]
+    if cursor is not None:
+        value, rowid = decode_analysis_cursor(cursor, sort)
+        if value is None:
+            steps = [([f"{column} IS NULL", "rowid < ?"], [rowid])]
+        else:
+            steps = [([f"({column}, rowid) < (?, ?)"], [value, rowid]), ([f"{column} IS NULL"], [])]
+
+    return [(f"SELECT {ANALYSIS_ROW_COLUMNS} FROM commitFileAnalysis WHERE {' AND '.join(conditions + extra)} "
+             f"ORDER BY {column} DESC, rowid DESC LIMIT ?", params + extra_params + [limit + 1])
+            for extra, extra_params in steps]
+
+
+def get_repo_analysis_page(repo_owner: str,
+                           repo_name: str,
+                           limit: int = ANALYSIS_PAGE_SIZE,
+                           cursor: str = None,
+                           sort: str = "complexity",
+                           author: str = None,
+                           filename_prefix: str = None,
+                           grade: str = None,
+                           since: str = None,
+                           until: str = None):
+    # Keyset pagination over one repository's rows, ordered by the sort column descending with rowid as the tie
+    # breaker, which is the order of the (repo_owner, repo_name, column) index. NULLs sort last, as in SQLite.
+    # Returns (rows, next_cursor); each row is a commitFileAnalysis row followed by its rowid and its complexity,
+    # comment ratio and maintainability grade letters.
+    queries = analysis_page_queries(repo_owner, repo_name, limit, cursor, sort, author, filename_prefix, grade, since,
+                                    until)
+    column = ANALYSIS_SORT_COLUMNS[sort]
+    limit = max(1, min(limit, ANALYSIS_MAX_PAGE_SIZE))
+
+    rows = []
+    try:
+        with db_connection() as (conn, db_cursor):
+            for query, params in queries:
+                if len(rows) > limit:
+                    break
+                rows += db_cursor.execute(query, params).fetchall()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_analysis_cursor(sort, last[COMMIT_ANALYSIS_COLUMNS.index(column)],
+                                             last[len(COMMIT_ANALYSIS_COLUMNS)])
+    return rows, next_cursor
+
+
+def get_repo_analysis_summary(repo_owner: str, repo_name: str):
+    # A single-row lookup of the repository's averages, metric counts, grade histograms and average grades
+    try:
+        with db_connection() as (conn, cursor):
+            cursor.execute(REPO_ANALYSIS_SUMMARY_QUERY, (repo_owner, repo_name))
+            columns = [description[0] for description in cursor.description]
+            return dict(zip(columns, cursor.fetchone()))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def rebuild_summaries(repo_owner: str = None, repo_name: str = None):
+    # Recomputes repoSummary and the contributor rollups, e.g. after editing commitFileAnalysis with triggers dropped
+    with db_connection() as (conn, cursor):
+        rebuild_rollups(conn, repo_owner, repo_name)
+
+
 def insert_commit_complexity(repo_owner,
                              repo_name,
                              commit_sha,
@@ -192,65 +501,209 @@ def insert_commit_complexity(repo_owner,
                              ltc_ratio,
                              commit_date):
     try:
-        conn, cursor = connect_db()
-        cursor.execute("INSERT INTO commitFileAnalysis (repo_owner, repo_name, commit_sha, author, filename, "
-                       "complexity, maintain_index, ltc_ratio, commit_date) VALUES  (?, ?, ?, ?, ?, ?, ?, ?, ?)", (repo_owner, repo_name, commit_sha, author,
-                                                                 filename, complexity, maintain_index, ltc_ratio, commit_date))
-
-        close_db(conn)
+        with db_connection() as (conn, cursor):
+            cursor.execute("INSERT INTO commitFileAnalysis (repo_owner, repo_name, commit_sha, author, filename, "
+                           "complexity, maintain_index, ltc_ratio, commit_date) VALUES  (?, ?, ?, ?, ?, ?, ?, ?, ?)", (repo_owner, repo_name, commit_sha, author,
+                                                                     filename, complexity, maintain_index, ltc_ratio, commit_date))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def get_cached_github_response(user_id: str, url: str):
+    with db_connection() as (conn, cursor):
+        cursor.execute(GITHUB_RESPONSE_CACHE_QUERY, (str(user_id), url))
+        return cursor.fetchone()
+
+
+def store_cached_github_response(user_id: str, url: str, etag, last_modified, body: bytes, headers: str = None):
+    with db_connection() as (conn, cursor):
+        cursor.execute(
+            "INSERT INTO githubResponseCache (user_id, url, etag, last_modified, body, headers, fetched_at) VALUES (?, "
+            "?, ?, ?, ?, ?, ?) ON CONFLICT(user_id, url) DO UPDATE SET etag = excluded.etag, last_modified = "
+            "excluded.last_modified, body = excluded.body, headers = excluded.headers, fetched_at = excluded.fetched_at",
+            (str(user_id), url, etag, last_modified, body, headers, datetime.now()))
+
+
+def get_commit_details_payload(repo_owner: str, repo_name: str, sha: str):
+    with db_connection() as (conn, cursor):
+        cursor.execute(COMMIT_DETAILS_QUERY, (repo_owner, repo_name, sha))
+        row = cursor.fetchone()
+
+        if row:
+            cursor.execute("UPDATE commitDetailsStore SET last_access=? WHERE repo_owner=? AND repo_name=? AND sha=?",
+                           (time.time(), repo_owner, repo_name, sha))
+            return row[0]
+    return None
+
+
+def store_commit_details_payload(repo_owner: str, repo_name: str, sha: str, payload: bytes):
+    with db_connection() as (conn, cursor):
+        cursor.execute("INSERT OR REPLACE INTO commitDetailsStore (repo_owner, repo_name, sha, payload, size, "
+                       "last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                       (repo_owner, repo_name, sha, payload, len(payload), time.time()))
+
+
+def get_commit_details_store_size():
+    with db_connection() as (conn, cursor):
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM commitDetailsStore")
+        return cursor.fetchone()
+
+
+def evict_commit_details(max_bytes: int):
+    # Drops least recently used payloads until the store fits in max_bytes, returns (entries, bytes) removed
+    with db_connection() as (conn, cursor):
+        count, total = cursor.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM commitDetailsStore").fetchone()
+        if total <= max_bytes:
+            return 0, 0
+
+        evicted = []
+        freed = 0
+        for rowid, size in cursor.execute("SELECT rowid, size FROM commitDetailsStore ORDER BY last_access ASC"):
+            if total - freed <= max_bytes:
+                break
+            evicted.append((rowid,))
+            freed += size
+
+        cursor.executemany("DELETE FROM commitDetailsStore WHERE rowid=?", evicted)
+        return len(evicted), freed
+
+
+UPSERT_COMMIT_ANALYSIS = """
+    INSERT INTO commitFileAnalysis (repo_owner, repo_name, commit_sha, author, filename, complexity, maintain_index,
+                                    ltc_ratio, commit_date)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(commit_sha, filename, repo_owner, repo_name) DO UPDATE SET
+        author = excluded.author,
+        complexity = excluded.complexity,
+        maintain_index = excluded.maintain_index,
+        ltc_ratio = excluded.ltc_ratio,
+        commit_date = excluded.commit_date
+"""
+
+
+class CommitAnalysisWriter:
+    # Buffers analysis rows and writes them in batches. Commits passed to mark_seen are recorded in the same
+    # transaction as the rows added before them, so a commit is never marked seen without its analysis.
+    def __init__(self, batch_size: int = ANALYSIS_BATCH_SIZE):
+        self.batch_size = max(1, batch_size)
+        self.rows_written = 0
+        self.flushes = 0
+        self._rows = []
+        self._seen = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self._rows = []
+            self._seen = []
+
+    def add(self,
+            repo_owner,
+            repo_name,
+            commit_sha,
+            author,
+            filename,
+            complexity,
+            maintain_index,
+            ltc_ratio,
+            commit_date):
+        self._rows.append((repo_owner, repo_name, commit_sha, author, filename, complexity, maintain_index, ltc_ratio,
+                           commit_date))
+
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def mark_seen(self, repo_owner, repo_name, commit_sha):
+        self._seen.append((repo_owner, repo_name, commit_sha))
+
+    def flush(self):
+        if not self._rows and not self._seen:
+            return
+
+        rows, self._rows = self._rows, []
+        seen, self._seen = self._seen, []
+        try:
+            with db_connection() as (conn, cursor):
+                cursor.executemany(UPSERT_COMMIT_ANALYSIS, rows)
+                cursor.executemany("INSERT OR IGNORE INTO repoSeenCommits (repo_owner, repo_name, sha) VALUES (?, ?, ?)",
+                                   seen)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+        self.rows_written += len(rows)
+        self.flushes += 1
+
+
+def get_sync_watermark(repo_owner: str, repo_name: str, branch: str):
+    with db_connection() as (conn, cursor):
+        cursor.execute(SYNC_WATERMARK_QUERY, (repo_owner, repo_name, branch))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def set_sync_watermark(repo_owner: str, repo_name: str, branch: str, head_sha: str):
+    with db_connection() as (conn, cursor):
+        cursor.execute(
+            "INSERT INTO repoSyncWatermark (repo_owner, repo_name, branch, head_sha, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(repo_owner, repo_name, branch) DO UPDATE SET head_sha=excluded.head_sha, "
+            "updated_at=excluded.updated_at",
+            (repo_owner, repo_name, branch, head_sha, datetime.now()))
+
+
+def get_seen_commits(repo_owner: str, repo_name: str):
+    with db_connection() as (conn, cursor):
+        cursor.execute(SEEN_COMMITS_QUERY, (repo_owner, repo_name))
+        return {row[0] for row in cursor.fetchall()}
+
+
+def insert_commit_complexity_batch(rows, batch_size: int = ANALYSIS_BATCH_SIZE):
+    with CommitAnalysisWriter(batch_size) as writer:
+        for row in rows:
+            writer.add(*row)
+
+    return writer.rows_written
+
+
 def get_repo_contributors(repoOwner: str, repoName: str):
     try:
-        conn, cursor = connect_db()
-        cursor.execute("SELECT DISTINCT author FROM commitFileAnalysis WHERE repo_name=? AND repo_owner=?",
-                       (repoName, repoOwner))
-        contributors = cursor.fetchall()
-
-        close_db(conn)
-        return contributors
+        with db_connection() as (conn, cursor):
+            cursor.execute(REPO_CONTRIBUTORS_QUERY, (repoName, repoOwner))
+            return cursor.fetchall()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 def get_repo_contributor_data(repoOwner: str, repoName: str, contributor: str):
     try:
-        conn, cursor = connect_db()
-        cursor.execute("SELECT DATE(commit_date) as commit_date, COUNT(DISTINCT commit_sha) AS commit_count FROM commitFileAnalysis WHERE repo_name=? AND repo_owner=? AND author=? GROUP BY DATE(commit_date) ORDER BY commit_date ASC",
-                       (repoName, repoOwner, contributor))
-        contributor_data = cursor.fetchall()
-
-        close_db(conn)
-        return contributor_data
+        with db_connection() as (conn, cursor):
+            cursor.execute(CONTRIBUTOR_DATA_QUERY, (repoName, repoOwner, contributor))
+            return cursor.fetchall()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 def get_repo_contributor_analysis(repo_owner: str, repo_name: str, author: str):
     try:
-        conn, cursor = connect_db()
-        cursor.execute("""
-            SELECT 
-                DATE(commit_date) as commit_date,
-                AVG(maintain_index) AS avg_maintain_index,
-                AVG(ltc_ratio) AS avg_ltc_ratio,
-                AVG(complexity) AS avg_complexity
-            FROM 
-                commitFileAnalysis
-            WHERE 
-                repo_name = ? 
-                AND repo_owner = ? 
-                AND author = ?
-            GROUP BY 
-                strftime('%Y-%m', commit_date)
-            ORDER BY 
-                commit_date ASC
-        """, (repo_name, repo_owner, author))
-        contributor_data = cursor.fetchall()
-
-        close_db(conn)
-        return contributor_data
+        with db_connection() as (conn, cursor):
+            cursor.execute(CONTRIBUTOR_ANALYSIS_QUERY, (repo_name, repo_owner, author))
+            return cursor.fetchall()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    parser.add_argument("command", choices=["rebuild-summaries"])
+    parser.add_argument("repo", nargs="?", help="owner/name, defaults to every repository")
+    args = parser.parse_args()
+
+    create_db()
+    owner, name = args.repo.split("/", 1) if args.repo else (None, None)
+    rebuild_summaries(owner, name)
+    close_pool()
@@ -0,0 +1,46 @@
+import os
+import zlib
+from typing import Optional
+import database
+from models import CommitDetails
+
+# A commit's files and patches never change once it exists, so details fetched from GitHub are kept locally,
+# compressed, and only dropped when the store grows past its size cap.
+COMMIT_STORE_MAX_BYTES = int(os.getenv("COMMIT_STORE_MAX_BYTES", 256 * 1024 * 1024))
+COMMIT_STORE_COMPRESSION_LEVEL = 6
+
+_counters = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+_stored_bytes = None
+
+
+def load_commit_details(repoOwner: str, repoName: str, sha: str) -> Optional[CommitDetails]:
+    payload = database.get_commit_details_payload(repoOwner, repoName, sha)
+    if payload is None:
+        _counters["misses"] += 1
+        return None
+
+    _counters["hits"] += 1
+    return CommitDetails.model_validate_json(zlib.decompress(payload))
+
+
+def save_commit_details(repoOwner: str, repoName: str, details: CommitDetails):
+    global _stored_bytes
+    payload = zlib.compress(details.model_dump_json().encode(), COMMIT_STORE_COMPRESSION_LEVEL)
+    database.store_commit_details_payload(repoOwner, repoName, details.sha, payload)
+    _counters["stored"] += 1
+
+    # the running total avoids summing the table on every write; eviction recounts it exactly
+    if _stored_bytes is None:
+        _stored_bytes = database.get_commit_details_store_size()[1]
+    else:
+        _stored_bytes += len(payload)
+
+    if _stored_bytes > COMMIT_STORE_MAX_BYTES:
+        evicted, freed = database.evict_commit_details(COMMIT_STORE_MAX_BYTES)
+        _counters["evicted"] += evicted
+        _stored_bytes = database.get_commit_details_store_size()[1]
+
+
+def commit_store_stats():
+    entries, size = database.get_commit_details_store_size()
+    return {**_counters, "entries": entries, "bytes": size, "maxBytes": COMMIT_STORE_MAX_BYTES}
@@ -0,0 +1,166 @@
+import asyncio
+import base64
+import os
+import re
+from typing import List, NamedTuple, Optional
+from fastapi import HTTPException
+
+GIT_MIRROR_DIR = os.getenv("GIT_MIRROR_DIR", ".git-mirrors")
+GITHUB_GIT_URL = os.getenv("GITHUB_GIT_URL", "https://github.com")
+# longest single line git log may produce, e.g. one line of a minified file
+GIT_LINE_LIMIT = 64 * 1024 * 1024
+# starts each commit's header line; spelled with git's %x00 escape in the format, since argv can't hold NUL
+COMMIT_MARKER = "\x00commit\x00"
+COMMIT_FORMAT = "%x00commit%x00%H%x00%an%x00%ad"
+BRANCH_REFSPEC = "+refs/heads/*:refs/heads/*"
+# GitHub's own limits on owner and repository names
+OWNER_PATTERN = re.compile(r"[A-Za-z0-9](?:[A-Za-z0-9-]{0,38})")
+REPO_NAME_PATTERN = re.compile(r"[A-Za-z0-9._-]{1,100}")
+
+
+class GitAuthor(NamedTuple):
+    name: str
+    date: str
+
+
+class GitFile(NamedTuple):
+    filename: str
+    patch: Optional[str]
+
+
+class GitCommit(NamedTuple):
+    sha: str
+    author: GitAuthor
+    files: List[GitFile]
+
+
+def check_repo_name(repoOwner: str, repoName: str):
+    # the names become directories under GIT_MIRROR_DIR, so anything that could escape it is refused up front
+    if (not OWNER_PATTERN.fullmatch(repoOwner) or not REPO_NAME_PATTERN.fullmatch(repoName)
+            or repoName in (".", "..")):
+        raise HTTPException(status_code=400, detail="Invalid repository name")
+
+
+def mirror_path(repoOwner: str, repoName: str):
+    check_repo_name(repoOwner, repoName)
+    return os.path.join(GIT_MIRROR_DIR, repoOwner.lower(), f"{repoName.lower()}.git")
+
+
+def mirror_url(repoOwner: str, repoName: str):
+    return f"{GITHUB_GIT_URL}/{repoOwner}/{repoName}.git"
+
+
+def _git_env(token: Optional[str] = None):
+    # The token is passed per command so it never lands in the mirror's config or remote url, and through the
+    # environment rather than `-c` so other local users can't read it from the process's argv.
+    env = {**os.environ, "GIT_TERMINAL_PROMPT": "0"}
+    if token:
+        credentials = base64.b64encode(f"x-access-token:{token}".encode()).decode()
+        env.update({"GIT_CONFIG_COUNT": "1", "GIT_CONFIG_KEY_0": "http.extraHeader",
+                    "GIT_CONFIG_VALUE_0": f"Authorization: Basic {credentials}"})
+    return env
+
+
+async def _git(*args, token: Optional[str] = None):
+    process = await asyncio.create_subprocess_exec(
+        "git", *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=_git_env(token))
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise HTTPException(status_code=502, detail=f"git {args[0]} failed: {stderr.decode(errors='replace').strip()}")
+    return stdout.decode(errors="replace").strip()
+
+
+async def update_mirror(repoOwner: str, repoName: str, token: Optional[str] = None):
+    # Clones a bare copy of the branches on first use; afterwards only the objects added since the last fetch are
+    # transferred. Only refs/heads is fetched: `clone --mirror` would also pull GitHub's refs/pull/* and every tag.
+    path = mirror_path(repoOwner, repoName)
+    if os.path.isdir(path):
+        await _git("-C", path, "fetch", "--prune", "--no-tags", "--quiet", "origin", BRANCH_REFSPEC, token=token)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        await _git("clone", "--bare", "--no-tags", "--quiet", mirror_url(repoOwner, repoName), path, token=token)
+    return path
+
+
+async def resolve_branch(path: str, branch: Optional[str] = None):
+    # (branch, head sha), using the mirror's HEAD (the remote's default branch) when none is given
+    if branch is None:
+        branch = (await _git("-C", path, "symbolic-ref", "--short", "HEAD")).removeprefix("heads/")
+    try:
+        return branch, await _git("-C", path, "rev-parse", "--verify", f"refs/heads/{branch}^{{commit}}")
+    except HTTPException:
+        raise HTTPException(status_code=404, detail="Branch not found")
+
+
+async def has_commit(path: str, sha: str):
+    try:
+        await _git("-C", path, "cat-file", "-e", f"{sha}^{{commit}}")
+        return True
+    except HTTPException:
+        return False
+
+
+def _file_patch(lines: List[str]):
+    # lines of one `diff --git` section -> (filename, patch). The patch keeps only the hunks, like GitHub's.
+    filename = None
+    for line in lines:
+        # git ends the ---/+++ header with a tab when the path holds a space
+        if line.startswith("+++ b/"):
+            filename = line[6:].removesuffix("\t")
+        elif line.startswith("--- a/") and filename is None:
+            filename = line[6:].removesuffix("\t")
+        elif line.startswith("rename to ") or line.startswith("copy to "):
+            filename = line.split(" to ", 1)[1]
+        elif line.startswith("@@"):
+            break
+    if filename is None:
+        # no +/- headers (binary or mode-only change): fall back to the b/ path of the diff line
+        filename = lines[0].split(" b/", 1)[-1]
+
+    hunk_start = next((i for i, line in enumerate(lines) if line.startswith("@@")), None)
+    patch = "\n".join(lines[hunk_start:]) if hunk_start is not None else None
+    return GitFile(filename, patch)
+
+
+def _build_commit(header: str, diff_lines: List[str]):
+    sha, name, date = header[len(COMMIT_MARKER):].split("\x00", 2)
+    sections = []
+    for line in diff_lines:
+        if line.startswith("diff --git "):
+            sections.append([line])
+        elif sections:
+            sections[-1].append(line)
+    return GitCommit(sha, GitAuthor(name, date), [_file_patch(section) for section in sections])
+
+
+async def iter_commit_patches(path: str, head_sha: str, base_sha: Optional[str] = None):
+    # Streams `git log -p` for commits reachable from head_sha but not base_sha, one GitCommit at a time, without
+    # holding the whole log in memory. Merge commits carry no diff, as in plain `git log -p`.
+    revisions = [head_sha] + ([f"^{base_sha}"] if base_sha else [])
+    process = await asyncio.create_subprocess_exec(
+        "git", "-C", path, "-c", "core.quotePath=false", "log", "-p", "--no-color", "--no-ext-diff",
+        "--date=format-local:%Y-%m-%dT%H:%M:%SZ", f"--format={COMMIT_FORMAT}", *revisions, "--",
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, limit=GIT_LINE_LIMIT,
+        env={**os.environ, "TZ": "UTC"})
+
+    try:
+        header, diff_lines = None, []
+        async for raw_line in process.stdout:
+            line = raw_line.decode(errors="replace").rstrip("\n")
+            if line.startswith(COMMIT_MARKER):
+                if header is not None:
+                    yield _build_commit(header, diff_lines)
+                header, diff_lines = line, []
+            elif header is not None:
+                diff_lines.append(line)
+
+        if header is not None:
+            yield _build_commit(header, diff_lines)
+
+        stderr = await process.stderr.read()
+        if await process.wait() != 0:
+            raise HTTPException(status_code=502, detail=f"git log failed: {stderr.decode(errors='replace').strip()}")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
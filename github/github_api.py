@@ -0,0 +1,231 @@
+import asyncio
+import datetime
+import os
+from collections import deque
+from itertools import islice
+from typing import AsyncIterable, Iterable, Optional, Union
+from urllib.parse import quote
+import httpx
+from fastapi import HTTPException
+from models import RepoCommit, CommitDetails, CommitStats, CommitFile
+from .github_client import GitHubClient, get_github_client
+from .commit_store import load_commit_details, save_commit_details
+
+COMMIT_FETCH_CONCURRENCY = int(os.getenv("COMMIT_FETCH_CONCURRENCY", 8))
+PAGE_FETCH_CONCURRENCY = int(os.getenv("PAGE_FETCH_CONCURRENCY", 4))
+GITHUB_PER_PAGE = 100
+
+
+async def _fetch_page(client: GitHubClient, url: str, token: str, params: dict, cache_user: Optional[str] = None):
+    if cache_user is not None:
+        response = await client.get_cached(url, token, cache_user, params=params)
+    else:
+        response = await client.get(url, token, params=params)
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail="GitHub API request failed")
+    return response
+
+
+def _page_items(response, items_key: Optional[str]):
+    data = response.json()
+    return data[items_key] if items_key else data
+
+
+def _link_page(response, rel: str):
+    link = response.links.get(rel)
+    if link is None:
+        return None
+    page = httpx.URL(link["url"]).params.get("page")
+    return int(page) if page is not None else None
+
+
+async def paginate(url: str,
+                   token: str,
+                   params: Optional[dict] = None,
+                   items_key: Optional[str] = None,
+                   concurrency: int = PAGE_FETCH_CONCURRENCY,
+                   client: Optional[GitHubClient] = None,
+                   cache_user: Optional[str] = None):
+    # Yields every item of a paginated GitHub listing in page order. The first page tells us the `last` page from
+    # its Link header, after which the remaining pages are downloaded `concurrency` at a time.
+    client = client or get_github_client()
+    params = {"per_page": GITHUB_PER_PAGE, **(params or {})}
+
+    response = await _fetch_page(client, url, token, params, cache_user)
+    for item in _page_items(response, items_key):
+        yield item
+
+    last_page = _link_page(response, "last")
+    if last_page is None:
+        # some endpoints only advertise `next`, so walk them one at a time
+        next_url = response.links.get("next", {}).get("url")
+        while next_url:
+            response = await _fetch_page(client, next_url, token, {}, cache_user)
+            for item in _page_items(response, items_key):
+                yield item
+            next_url = response.links.get("next", {}).get("url")
+        return
+
+    def page_task(page: int):
+        return asyncio.create_task(_fetch_page(client, url, token, {**params, "page": page}, cache_user))
+
+    pages = iter(range(2, last_page + 1))
+    in_flight = deque()
+    try:
+        for page in islice(pages, max(1, concurrency)):
+            in_flight.append(page_task(page))
+
+        while in_flight:
+            response = await in_flight.popleft()
+            for page in islice(pages, 1):
+                in_flight.append(page_task(page))
+
+            for item in _page_items(response, items_key):
+                yield item
+    finally:
+        for task in in_flight:
+            task.cancel()
+        # awaited so cancellation has finished when the generator closes, and a sibling page's failure is retrieved
+        await asyncio.gather(*in_flight, return_exceptions=True)
+
+
+async def iter_commits(repoOwner: str, repoName: str, token: str, since: Optional[str] = None):
+    params = {}
+
+    if since:
+        since_datetime = datetime.datetime.strptime(since, "%Y-%m-%d %H:%M:%S.%f")
+        since_isoformat = since_datetime.strftime("%Y-%m-%dT%H:%M:%SZ")
+        params['since'] = since_isoformat
+
+    async for commit in paginate(f"/repos/{repoOwner}/{repoName}/commits", token, params):
+        yield RepoCommit(**commit)
+
+
+async def get_branch_head(repoOwner: str, repoName: str, token: str, branch: Optional[str] = None,
+                          cache_user: Optional[str] = None):
+    # (branch, head sha), using the repository's default branch when none is given
+    client = get_github_client()
+    if branch is None:
+        repo = await _fetch_page(client, f"/repos/{repoOwner}/{repoName}", token, {}, cache_user)
+        branch = repo.json()["default_branch"]
+
+    response = await client.get(f"/repos/{repoOwner}/{repoName}/branches/{quote(branch, safe='')}", token)
+    if response.status_code == 404:
+        raise HTTPException(status_code=404, detail="Branch not found")
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail="GitHub API request failed")
+    return branch, response.json()["commit"]["sha"]
+
+
+async def iter_new_commit_shas(repoOwner: str, repoName: str, token: str, head_sha: str,
+                               base_sha: Optional[str] = None):
+    # Shas reachable from head_sha but not from base_sha, via the compare API. Without a base, or when the base no
+    # longer exists (e.g. after a force push), falls back to the head's full history.
+    if base_sha is not None:
+        yielded = False
+        try:
+            async for commit in paginate(f"/repos/{repoOwner}/{repoName}/compare/{base_sha}...{head_sha}", token,
+                                         items_key="commits"):
+                yielded = True
+                yield commit["sha"]
+            return
+        except HTTPException as e:
+            if yielded or e.status_code != 404:
+                raise
+
+    async for commit in paginate(f"/repos/{repoOwner}/{repoName}/commits", token, {"sha": head_sha}):
+        yield commit["sha"]
+
+
+async def check_repo_access(repoOwner: str, repoName: str, token: str, user_id: str):
+    # The commit store is shared by every user, so it is only read for callers whose token can see the repository.
+    # The lookup is a per-user conditional GET: revalidating it costs a round trip but no rate-limit budget.
+    response = await get_github_client().get_cached(f"/repos/{repoOwner}/{repoName}", token, user_id)
+    if response.status_code != 200:
+        raise HTTPException(status_code=404, detail="Repository not Found")
+
+
+async def fetch_commit_details(client: GitHubClient, token: str, repoOwner: str, repoName: str, sha: str):
+    stored = load_commit_details(repoOwner, repoName, sha)
+    if stored is not None:
+        return stored
+
+    response = await client.get(f"/repos/{repoOwner}/{repoName}/commits/{sha}", token)
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail="GitHub API request failed")
+
+    repo_commits_details = response.json()
+    commitDetails = CommitDetails(
+        sha=repo_commits_details['sha'],
+        commit=repo_commits_details['commit'],
+        stats=CommitStats(**repo_commits_details['stats']),
+        files=[CommitFile(**file_data) for file_data in repo_commits_details['files']]
+    )
+
+    # stored under the full sha GitHub resolved to, so branch names and short shas are never cached
+    save_commit_details(repoOwner, repoName, commitDetails)
+    return commitDetails
+
+
+async def fetch_commit_details_concurrently(shas: Union[Iterable[str], AsyncIterable[str]],
+                                            repoOwner: str,
+                                            repoName: str,
+                                            token: str,
+                                            concurrency: int = COMMIT_FETCH_CONCURRENCY,
+                                            client: Optional[GitHubClient] = None):
+    # Yields (sha, CommitDetails) in completion order, or (sha, exception) if that commit could not be fetched.
+    # `shas` may be an async iterable (e.g. a paginated listing) so fetching starts before the listing is complete.
+    # The results queue is bounded so fetching stays at most `concurrency` commits ahead of the consumer.
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    results = asyncio.Queue(maxsize=max(1, concurrency))
+    listed = None
+    listing_error = None
+
+    client = client or get_github_client()
+
+    async def fetch(sha: str):
+        async with semaphore:
+            try:
+                result = await fetch_commit_details(client, token, repoOwner, repoName, sha)
+            except Exception as e:
+                result = e
+            await results.put((sha, result))
+
+    async def produce():
+        nonlocal listed, listing_error
+        try:
+            if isinstance(shas, AsyncIterable):
+                async for sha in shas:
+                    fetches.append(asyncio.create_task(fetch(sha)))
+            else:
+                for sha in shas:
+                    fetches.append(asyncio.create_task(fetch(sha)))
+        except Exception as e:
+            listing_error = e
+        listed = len(fetches)
+        await results.put(None)
+
+    # Tasks are tracked by hand rather than with a TaskGroup: a TaskGroup would see the GeneratorExit of a consumer
+    # that stops early and wrap it, hiding whatever error made the consumer stop.
+    fetches = []
+    producer = asyncio.create_task(produce())
+    try:
+        yielded = 0
+        while listed is None or yielded < listed:
+            item = await results.get()
+            if item is None:
+                if listing_error is not None:
+                    break
+                continue
+
+            yielded += 1
+            yield item
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+        for task in fetches:
+            task.cancel()
+        await asyncio.gather(*fetches, return_exceptions=True)
+
+    if listing_error is not None:
+        raise listing_error
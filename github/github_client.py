@@ -0,0 +1,134 @@
+import json
+import os
+from typing import Optional
+import httpx
+import database
+from .rate_limit import RateLimitScheduler
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+GITHUB_API_URL = "https://api.github.com"
+
+DEFAULT_HEADERS = {
+    "Accept": "application/vnd.github+json",
+    "X-GitHub-Api-Version": "2022-11-28",
+    "User-Agent": "CSC3094-api",
+}
+
+# response headers kept with a cached body and replayed on a 304; paginate reads the page count from Link
+CACHED_RESPONSE_HEADERS = ("Content-Type", "Link", "ETag", "Last-Modified")
+
+GITHUB_MAX_CONNECTIONS = int(os.getenv("GITHUB_MAX_CONNECTIONS", 100))
+GITHUB_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GITHUB_MAX_KEEPALIVE_CONNECTIONS", 20))
+GITHUB_KEEPALIVE_EXPIRY = float(os.getenv("GITHUB_KEEPALIVE_EXPIRY", 30))
+GITHUB_TIMEOUT = float(os.getenv("GITHUB_TIMEOUT", 15))
+GITHUB_CONNECT_TIMEOUT = float(os.getenv("GITHUB_CONNECT_TIMEOUT", 5))
+
+
+class GitHubClient:
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.http = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE and transport is None,
+            headers=DEFAULT_HEADERS,
+            limits=httpx.Limits(
+                max_connections=GITHUB_MAX_CONNECTIONS,
+                max_keepalive_connections=GITHUB_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=GITHUB_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(GITHUB_TIMEOUT, connect=GITHUB_CONNECT_TIMEOUT),
+            transport=transport,
+        )
+        self.cache_counters = {"hits": 0, "misses": 0, "revalidations": 0}
+        self.scheduler = RateLimitScheduler()
+
+    async def request(self, method: str, url: str, token: Optional[str] = None, headers: Optional[dict] = None,
+                      **kwargs):
+        request_headers = dict(headers or {})
+        if token:
+            request_headers["Authorization"] = f"Bearer {token}"
+
+        if not url.startswith("http"):
+            url = GITHUB_API_URL + url
+
+        if not token:
+            return await self.http.request(method, url, headers=request_headers, **kwargs)
+
+        # authenticated calls are queued behind the token's rate-limit budget and retried after rate limit responses
+        return await self.scheduler.send(
+            token, lambda: self.http.request(method, url, headers=request_headers, **kwargs))
+
+    async def get(self, url: str, token: Optional[str] = None, **kwargs):
+        return await self.request("GET", url, token, **kwargs)
+
+    async def get_cached(self, url: str, token: str, cache_user: str, params: Optional[dict] = None):
+        # Conditional GET backed by the githubResponseCache table. GitHub doesn't charge 304s against the rate limit,
+        # so a revalidated entry costs a round trip but no budget. A 304 is returned to the caller as the cached 200.
+        if not url.startswith("http"):
+            url = GITHUB_API_URL + url
+        cache_key = str(httpx.URL(url, params=params))
+
+        headers = {}
+        cached = database.get_cached_github_response(cache_user, cache_key)
+        if cached:
+            etag, last_modified, body, stored_headers = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+            self.cache_counters["revalidations"] += 1
+
+        response = await self.get(cache_key, token, headers=headers)
+
+        if response.status_code == 304 and cached:
+            self.cache_counters["hits"] += 1
+            # the 304 only carries validators, so the replayed response gets the headers stored with the body
+            return httpx.Response(200, content=body, headers=json.loads(stored_headers or "{}"),
+                                  request=response.request)
+
+        self.cache_counters["misses"] += 1
+        if response.status_code == 200 and ("ETag" in response.headers or "Last-Modified" in response.headers):
+            kept_headers = {name: response.headers[name] for name in CACHED_RESPONSE_HEADERS if name in response.headers}
+            database.store_cached_github_response(cache_user, cache_key, response.headers.get("ETag"),
+                                                  response.headers.get("Last-Modified"), response.content,
+                                                  json.dumps(kept_headers))
+        return response
+
+    def rate_limit_status(self, token: str):
+        return self.scheduler.status(token)
+
+    def cache_stats(self):
+        return dict(self.cache_counters)
+
+    async def post(self, url: str, token: Optional[str] = None, **kwargs):
+        return await self.request("POST", url, token, **kwargs)
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+_client: Optional[GitHubClient] = None
+
+
+def get_github_client():
+    # Normally created by the app lifespan; created lazily so scripts and tests work without it
+    global _client
+    if _client is None:
+        _client = GitHubClient()
+    return _client
+
+
+def start_github_client(transport: Optional[httpx.AsyncBaseTransport] = None):
+    global _client
+    _client = GitHubClient(transport)
+    return _client
+
+
+async def close_github_client():
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
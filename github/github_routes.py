@@ -1,35 +1,44 @@
-from fastapi import APIRouter, HTTPException, Depends
-from auth.auth_utils import AuthHandler
-from models import GitHubCode, GitHubRepo, RepoCommit, CommitDetails, CommitStats, CommitFile, RepoContributor
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from auth.auth_utils import get_current_user
+from models import GitHubCode, GitHubRepo, RepoCommit, CommitDetails, CommitFile
 from typing import List, Optional
-import httpx
 import os
-from database import storeGitToken, getGitToken, getRepoLastAnalysedTime, insert_commit_complexity, setLastAnalysedTime, \
-    getRepoAnalysis, get_repo_contributors, get_repo_contributor_data, get_repo_contributor_analysis
-from fastapi.responses import JSONResponse
+from database import storeGitToken, getGitToken, getRepoLastAnalysedTime, get_repo_contributors, \
+    get_repo_contributor_data, get_repo_contributor_analysis, get_repo_analysis_page, get_repo_analysis_summary, \
+    ANALYSIS_PAGE_SIZE, ANALYSIS_MAX_PAGE_SIZE, GRADE_LETTERS, COMMENT_GRADE_LETTERS
+from fastapi.responses import JSONResponse, StreamingResponse
+from contextlib import aclosing
+from functools import lru_cache
+from types import MappingProxyType
 from pydantic import HttpUrl
 import json
-import datetime
-from analysis import calculate_cyclomatic_complexity, calculate_lines_to_comments_ratio, calculate_maintainability_index
-from utils import grade_complexity, grade_comment_ratio, grade_maintainability
-
-auth_handler = AuthHandler()
+from utils import GRADE_CLASSES, COMPLEXITY_GRADE_TEXT
+from responses import json_response
+from .github_client import get_github_client
+from .commit_store import commit_store_stats
+from .github_api import paginate, iter_commits, fetch_commit_details, check_repo_access
+from .jobs import get_job_manager, FAILED
+from .repos_cache import repos_cache
 
 github_router = APIRouter(
     prefix='/github',
     tags=['github'],
-    dependencies=[Depends(auth_handler.authWrapper)]
+    dependencies=[Depends(get_current_user)]
 )
 
 
-def get_language_colour(language: str):
+@lru_cache(maxsize=None)
+def load_language_colours():
+    # read once per process; read-only so every request can share it
     script_dir = os.path.dirname(__file__)
     json_file_path = os.path.join(script_dir, 'language-colours.json')
 
     with open(json_file_path, 'r') as file:
-        data = json.load(file)
+        return MappingProxyType(json.load(file))
 
-        return data.get(language, None)
+
+def get_language_colour(language: str):
+    return load_language_colours().get(language, None)
 
 
 async def get_access_token(code: str):
@@ -41,8 +50,8 @@ async def get_access_token(code: str):
 
     headers = {"Accept": "application/json"}
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post("https://github.com/login/oauth/access_token", headers=headers, data=data)
+    response = await get_github_client().post("https://github.com/login/oauth/access_token", headers=headers,
+                                              data=data)
 
     if response.status_code == 200:
         try:
@@ -54,7 +63,7 @@ async def get_access_token(code: str):
 
 
 @github_router.post("/access-token")
-async def connectGithub(code: GitHubCode, user_id=Depends(auth_handler.authWrapper)):
+async def connectGithub(code: GitHubCode, user_id=Depends(get_current_user)):
     access_token = await get_access_token(code.code)
     result = storeGitToken(access_token, user_id)
 
@@ -65,103 +74,151 @@ async def connectGithub(code: GitHubCode, user_id=Depends(auth_handler.authWrapp
 
 
 @github_router.get("/repos", response_model=List[GitHubRepo])
-async def getRepos(user_id=Depends(auth_handler.authWrapper)):
+async def getRepos(user_id=Depends(get_current_user)):
     token = getGitToken(user_id)
     if token:
-        headers = {"Authorization": f"Bearer {token}"}
-        async with httpx.AsyncClient() as client:
-            response = await client.get("https://api.github.com/user/repos", headers=headers)
-
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail="GitHub API request failed")
-
-        github_repos = response.json()
-        mapped_repos = [GitHubRepo(**repo) for repo in github_repos]
-
-        for i, repo in enumerate(mapped_repos):
-            mapped_repos[i].commitsUrl = HttpUrl(str(repo.commitsUrl).replace('%7B/sha%7D', ''))
-
-            if mapped_repos[i].language is not None:
-                mapped_repos[i].languageColour = get_language_colour(mapped_repos[i].language)
-
-        return mapped_repos
+        # keyed on the token too, so reconnecting GitHub never serves the previous account's repositories
+        return await repos_cache.get((user_id, token), lambda: fetch_user_repos(token, user_id))
     else:
         raise HTTPException(status_code=400, detail="Github not connected")
 
 
-@github_router.get("/repo-overview")
-async def getRepoOverview(repoOwner: str, repoName: str, user_id=Depends(auth_handler.authWrapper)):
-    token = getGitToken(user_id)
+async def fetch_user_repos(token: str, user_id: str):
+    mapped_repos = [GitHubRepo(**repo) async for repo in paginate("/user/repos", token, cache_user=user_id)]
 
-    repo_url = f"https://api.github.com/repos/{repoOwner}/{repoName}"
-    async with httpx.AsyncClient() as client:
-        repo_response = await client.get(repo_url, headers={"Authorization": f"Bearer {token}"})
-    repo_data = repo_response.json()
+    for i, repo in enumerate(mapped_repos):
+        mapped_repos[i].commitsUrl = HttpUrl(str(repo.commitsUrl).replace('%7B/sha%7D', ''))
 
-    if 'message' in repo_data and repo_data['message'] == 'Not Found':
-        raise HTTPException(status_code=404, detail="Repository not Found")
-
-    last_analysed = getRepoLastAnalysedTime(repoName, repoOwner)
-    analysis = getRepoAnalysis(repoOwner, repoName)
+        if mapped_repos[i].language is not None:
+            mapped_repos[i].languageColour = get_language_colour(mapped_repos[i].language)
 
-    struct_anal = []
-    total_complexity_files = 0
-    total_complexity = 0
-    total_comment_ratio_files = 0
-    total_comment_ratio = 0.0
-    total_mi_files = 0
-    total_mi = 0.0
+    return mapped_repos
 
-    if analysis:
-        for i, file in enumerate(analysis):
-            file_anal = {
-                "sha": file[2],
-                "author": file[3],
-                "fileName": file[4],
-                "complexity": file[5],
-                "maintain_index": file[6],
-                "ltc_ratio": file[7],
-                "commit_date": file[8]
-            }
 
-            if file_anal['complexity'] is not None:
-                result = grade_complexity(file_anal['complexity'])
-
-                file_anal['gradeText'] = result[0]
-                file_anal['grade'] = result[1]
-                file_anal['gradeClass'] = result[2]
+def structure_analysis_row(file):
+    # rows come from get_repo_analysis_page with their grade letters already bucketed by SQLite
+    complexity_grade, comment_grade, maintainability_grade = file[10:13]
+    file_anal = {
+        "sha": file[2],
+        "author": file[3],
+        "fileName": file[4],
+        "complexity": file[5],
+        "maintain_index": file[6],
+        "ltc_ratio": file[7],
+        "commit_date": file[8]
+    }
 
-                total_complexity += file_anal['complexity']
-                total_complexity_files += 1
+    if complexity_grade is not None:
+        file_anal['gradeText'] = COMPLEXITY_GRADE_TEXT[complexity_grade]
+        file_anal['grade'] = complexity_grade
+        file_anal['gradeClass'] = GRADE_CLASSES[complexity_grade]
+
+    if comment_grade is not None:
+        file_anal['commentGrade'] = comment_grade
+        file_anal['commentGradeClass'] = GRADE_CLASSES[comment_grade]
+
+    if maintainability_grade is not None:
+        file_anal['maintainabilityGrade'] = maintainability_grade
+        file_anal['maintainabilityGradeClass'] = GRADE_CLASSES[maintainability_grade]
+
+    return file_anal
+
+
+# columnar analysis: column name -> position in a get_repo_analysis_page row
+ANALYSIS_COLUMNS = {
+    "sha": 2,
+    "author": 3,
+    "fileName": 4,
+    "complexity": 5,
+    "maintain_index": 6,
+    "ltc_ratio": 7,
+    "commit_date": 8,
+    "grade": 10,
+    "commentGrade": 11,
+    "maintainabilityGrade": 12,
+}
+# columns sent as indexes into a list of their distinct values
+DICTIONARY_COLUMNS = ("author", "fileName")
+
+
+def columnar_analysis(rows):
+    # One value array per column instead of one dict per file. Grade text and classes are left to the client, which
+    # gets the letter -> text/class tables once.
+    values = {column: [row[position] for row in rows] for column, position in ANALYSIS_COLUMNS.items()}
+    dictionaries = {}
+    for column in DICTIONARY_COLUMNS:
+        codes = {}
+        values[column] = [codes.setdefault(value, len(codes)) for value in values[column]]
+        dictionaries[column] = list(codes)
 
-            if file_anal['ltc_ratio'] is not None:
-                result = grade_comment_ratio(file_anal['ltc_ratio'])
+    return {
+        "format": "columnar",
+        "length": len(rows),
+        "columns": list(ANALYSIS_COLUMNS),
+        "values": list(values.values()),
+        "dictionaries": dictionaries,
+        "gradeClasses": GRADE_CLASSES,
+        "complexityGradeText": COMPLEXITY_GRADE_TEXT,
+    }
 
-                file_anal['commentGrade'] = result[0]
-                file_anal['commentGradeClass'] = result[1]
 
-                total_comment_ratio += file_anal['ltc_ratio']
-                total_comment_ratio_files += 1
+def get_analysis_page(repoOwner: str, repoName: str, limit: int, cursor: Optional[str], sort: str,
+                      author: Optional[str], filenamePrefix: Optional[str], grade: Optional[str], since: Optional[str],
+                      until: Optional[str], format: str = "rows"):
+    rows, next_cursor = get_repo_analysis_page(repoOwner, repoName, limit, cursor, sort, author, filenamePrefix, grade,
+                                               since, until)
+    if format == "columnar":
+        return columnar_analysis(rows), next_cursor
+    return [structure_analysis_row(row) for row in rows], next_cursor
 
-            if file_anal['maintain_index'] is not None:
-                result = grade_maintainability(file_anal['maintain_index'])
 
-                file_anal['maintainabilityGrade'] = result[0]
-                file_anal['maintainabilityGradeClass'] = result[1]
+@github_router.get("/repo-overview")
+async def getRepoOverview(repoOwner: str,
+                          repoName: str,
+                          request: Request,
+                          limit: int = Query(ANALYSIS_PAGE_SIZE, ge=1, le=ANALYSIS_MAX_PAGE_SIZE),
+                          cursor: Optional[str] = None,
+                          sort: str = "complexity",
+                          author: Optional[str] = None,
+                          filenamePrefix: Optional[str] = None,
+                          grade: Optional[str] = None,
+                          since: Optional[str] = None,
+                          until: Optional[str] = None,
+                          format: str = Query("rows", pattern="^(rows|columnar)$"),
+                          user_id=Depends(get_current_user)):
+    overview = await build_repo_overview(repoOwner, repoName, user_id, limit, cursor, sort, author, filenamePrefix,
+                                         grade, since, until, format)
+    if format == "columnar":
+        return json_response(request, overview)
+    return overview
+
+
+async def build_repo_overview(repoOwner: str,
+                              repoName: str,
+                              user_id: str,
+                              limit: int = ANALYSIS_PAGE_SIZE,
+                              cursor: Optional[str] = None,
+                              sort: str = "complexity",
+                              author: Optional[str] = None,
+                              filenamePrefix: Optional[str] = None,
+                              grade: Optional[str] = None,
+                              since: Optional[str] = None,
+                              until: Optional[str] = None,
+                              format: str = "rows"):
+    token = getGitToken(user_id)
 
-                total_mi += file_anal['maintain_index']
-                total_mi_files += 1
+    repo_response = await get_github_client().get_cached(f"/repos/{repoOwner}/{repoName}", token, user_id)
+    repo_data = repo_response.json()
 
-            struct_anal.append(file_anal)
+    if 'message' in repo_data and repo_data['message'] == 'Not Found':
+        raise HTTPException(status_code=404, detail="Repository not Found")
 
-    average_complexity = round(total_complexity / total_complexity_files, 2) if total_complexity_files != 0 else 0
-    average_comment_ratio = round(total_comment_ratio / total_comment_ratio_files,
-                                  2) if total_comment_ratio_files != 0 else 0
-    average_mi = round(total_mi / total_mi_files, 2) if total_mi_files != 0 else 0
+    last_analysed = getRepoLastAnalysedTime(repoName, repoOwner)
+    struct_anal, next_cursor = get_analysis_page(repoOwner, repoName, limit, cursor, sort, author, filenamePrefix,
+                                                 grade, since, until, format)
 
-    average_complexity_grades = grade_complexity(average_complexity)
-    average_comments_ratio_grades = grade_comment_ratio(average_comment_ratio)
-    average_mi_grades = grade_maintainability(average_mi)
+    # the summary always covers the whole repository, not just the returned page
+    summary = get_repo_analysis_summary(repoOwner, repoName)
 
     return {
         "description": repo_data["description"],
@@ -171,106 +228,86 @@ async def getRepoOverview(repoOwner: str, repoName: str, user_id=Depends(auth_ha
         "owner_url": repo_data["owner"]["avatar_url"],
         "lastAnalysed": last_analysed,
         "analysis": struct_anal,
-        "averageComplexity": average_complexity,
-        "averageComplexityGrade": average_complexity_grades[1],
-        "averageComplexityGradeClass": average_complexity_grades[2],
-        "averageCommentRatio": average_comment_ratio,
-        "averageCommentRatioGrade": average_comments_ratio_grades[0],
-        "averageCommentRatioClass": average_comments_ratio_grades[1],
-        "averageMaintainability": average_mi,
-        "averageMaintainabilityGrade": average_mi_grades[0],
-        "averageMaintainabilityClass": average_mi_grades[1]
+        "nextCursor": next_cursor,
+        "averageComplexity": summary["avg_complexity"],
+        "averageComplexityGrade": summary["complexity_grade"],
+        "averageComplexityGradeClass": GRADE_CLASSES[summary["complexity_grade"]],
+        "averageCommentRatio": summary["avg_ltc_ratio"],
+        "averageCommentRatioGrade": summary["comment_grade"],
+        "averageCommentRatioClass": GRADE_CLASSES[summary["comment_grade"]],
+        "averageMaintainability": summary["avg_maintain_index"],
+        "averageMaintainabilityGrade": summary["maintainability_grade"],
+        "averageMaintainabilityClass": GRADE_CLASSES[summary["maintainability_grade"]],
+        "fileCount": summary["files"],
+        "gradeCounts": {
+            "complexity": {letter: summary[f"complexity_{letter.lower()}"] for letter in GRADE_LETTERS},
+            "commentRatio": {letter: summary[f"comment_{letter.lower()}"] for letter in COMMENT_GRADE_LETTERS},
+            "maintainability": {letter: summary[f"maintainability_{letter.lower()}"] for letter in GRADE_LETTERS},
+        }
     }
 
 
+@github_router.post("/update-repo")
+async def startRepoUpdate(repoOwner: str, repoName: str, user_id=Depends(get_current_user)):
+    job, created = get_job_manager().submit(repoOwner, repoName, user_id)
+    return JSONResponse(content={**job.to_dict(), "attached": not created}, status_code=202)
+
+
 @github_router.get("/update-repo")
-async def updateRepo(repoOwner: str, repoName: str, user_id=Depends(auth_handler.authWrapper)):
-    last_updated = getRepoLastAnalysedTime(repoName, repoOwner)
-    try:
-        commits = await getCommits(repoOwner, repoName, last_updated, user_id)
+async def updateRepo(repoOwner: str, repoName: str, user_id=Depends(get_current_user)):
+    manager = get_job_manager()
+    job, _ = manager.submit(repoOwner, repoName, user_id)
+    await manager.wait(job)
+
+    if job.status == FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
 
-        for commit in commits:
-            commitChanges = await getCommitChanges(commit.sha, repoOwner, repoName, user_id)
+    overview = await build_repo_overview(repoOwner, repoName, user_id)
+    return overview, job.commits
 
-            for file in commitChanges.files:
-                cc = calculate_cyclomatic_complexity(file.patch, file.filename)
-                mi = calculate_maintainability_index(file.patch, file.filename, cc)
-                ltc = calculate_lines_to_comments_ratio(file.patch, file.filename)
 
-                if cc is None and mi is None and ltc is None:
+@github_router.get("/update-repo/stream")
+async def streamRepoUpdate(repoOwner: str, repoName: str, user_id=Depends(get_current_user)):
+    job, _ = get_job_manager().submit(repoOwner, repoName, user_id)
+
+    async def event_stream():
+        async with aclosing(job.events()) as events:
+            async for event in events:
+                if event is None:
+                    yield ": keep-alive\n\n"
                     continue
 
-                insert_commit_complexity(
-                    repoOwner,
-                    repoName,
-                    commit.sha,
-                    commit.commit.author.name,
-                    file.filename,
-                    cc,
-                    mi,
-                    ltc,
-                    commit.commit.author.date
-                )
+                payload = {key: value for key, value in event.items() if key != "event"}
+                yield f"event: {event['event']}\ndata: {json.dumps(payload)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-        setLastAnalysedTime(repoOwner, repoName)
-        overview = await getRepoOverview(repoOwner, repoName, user_id)
 
-        return overview, len(commits)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@github_router.get("/jobs/{job_id}")
+async def getJob(job_id: str):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
 
 
 @github_router.get("/commits", response_model=List[RepoCommit])
 async def getCommits(repoOwner: str, repoName: str, since: Optional[str] = None,
-                     user_id=Depends(auth_handler.authWrapper)):
+                     user_id=Depends(get_current_user)):
     token = getGitToken(user_id)
     if token:
-        headers = {"Authorization": f"Bearer {token}"}
-        params = {"per_page": 100}
-
-        if since:
-            since_datetime = datetime.datetime.strptime(since, "%Y-%m-%d %H:%M:%S.%f")
-            since_isoformat = since_datetime.strftime("%Y-%m-%dT%H:%M:%SZ")
-            params['since'] = since_isoformat
-
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"https://api.github.com/repos/{repoOwner}/{repoName}/commits",
-                params=params,
-                headers=headers
-            )
-
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail="GitHub API request failed")
-
-            repo_commits = response.json()
-            return [RepoCommit(**commit) for commit in repo_commits]
+        return [commit async for commit in iter_commits(repoOwner, repoName, token, since)]
     else:
         raise HTTPException(status_code=400, detail="Github not connected")
 
 
 @github_router.get("/commit/changes", response_model=CommitDetails)
-async def getCommitChanges(sha: str, repoOwner: str, repoName: str, user_id=Depends(auth_handler.authWrapper)):
+async def getCommitChanges(sha: str, repoOwner: str, repoName: str, user_id=Depends(get_current_user)):
     token = getGitToken(user_id)
     if token:
-        headers = {"Authorization": f"Bearer {token}"}
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"https://api.github.com/repos/{repoOwner}/{repoName}/commits/{sha}",
-                headers=headers
-            )
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail="GitHub API request failed")
-
-            repo_commits_details = response.json()
-            commitDetails = CommitDetails(
-                sha=repo_commits_details['sha'],
-                commit=repo_commits_details['commit'],
-                stats=CommitStats(**repo_commits_details['stats']),
-                files=[CommitFile(**file_data) for file_data in repo_commits_details['files']]
-            )
-
-            return commitDetails
+        await check_repo_access(repoOwner, repoName, token, user_id)
+        return await fetch_commit_details(get_github_client(), token, repoOwner, repoName, sha)
     else:
         raise HTTPException(status_code=400, detail="Github not connected")
 
@@ -280,53 +317,38 @@ async def getCommitChangesFile(sha: str,
                                repoOwner: str,
                                repoName: str,
                                filename: str,
-                               user_id=Depends(auth_handler.authWrapper)):
+                               user_id=Depends(get_current_user)):
     shaChanges = await getCommitChanges(sha, repoOwner, repoName, user_id)
-    commit_files = shaChanges.files
-    filtered_files = [file for file in commit_files if file.filename == filename]
+
+    filtered_files = [file for file in shaChanges.files if file.filename == filename]
+    if not filtered_files:
+        raise HTTPException(status_code=404, detail="File not found in commit")
     return filtered_files[0]
 
 
 @github_router.get("/issues")
-async def GetIssues(repoOwner: str, repoName: str):
-    analysis = getRepoAnalysis(repoOwner, repoName)
-
-    struct_anal = []
-
-    if analysis:
-        for i, file in enumerate(analysis):
-            file_anal = {
-                "sha": file[2],
-                "author": file[3],
-                "fileName": file[4],
-                "complexity": file[5],
-                "maintain_index": file[6],
-                "ltc_ratio": file[7],
-                "commit_date": file[8]
-            }
-
-            if file_anal['complexity'] is not None:
-                result = grade_complexity(file_anal['complexity'])
-
-                file_anal['gradeText'] = result[0]
-                file_anal['grade'] = result[1]
-                file_anal['gradeClass'] = result[2]
-
-            if file_anal['ltc_ratio'] is not None:
-                result = grade_comment_ratio(file_anal['ltc_ratio'])
-
-                file_anal['commentGrade'] = result[0]
-                file_anal['commentGradeClass'] = result[1]
-
-            if file_anal['maintain_index'] is not None:
-                result = grade_maintainability(file_anal['maintain_index'])
-
-                file_anal['maintainabilityGrade'] = result[0]
-                file_anal['maintainabilityGradeClass'] = result[1]
-
-            struct_anal.append(file_anal)
-
-        return struct_anal
+async def GetIssues(repoOwner: str,
+                    repoName: str,
+                    request: Request,
+                    response: Response,
+                    limit: int = Query(ANALYSIS_PAGE_SIZE, ge=1, le=ANALYSIS_MAX_PAGE_SIZE),
+                    cursor: Optional[str] = None,
+                    sort: str = "complexity",
+                    author: Optional[str] = None,
+                    filenamePrefix: Optional[str] = None,
+                    grade: Optional[str] = None,
+                    since: Optional[str] = None,
+                    until: Optional[str] = None,
+                    format: str = Query("rows", pattern="^(rows|columnar)$")):
+    struct_anal, next_cursor = get_analysis_page(repoOwner, repoName, limit, cursor, sort, author, filenamePrefix,
+                                                 grade, since, until, format)
+
+    # the body stays a plain list (or one columnar object), so the cursor for the next page travels in a header
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor is not None else {}
+    if format == "columnar":
+        return json_response(request, struct_anal, headers=headers)
+    response.headers.update(headers)
+    return struct_anal
 
 
 @github_router.get("/repository-contributors")
@@ -343,6 +365,21 @@ async def get_repository_contributor_report(repoOwner: str, repoName: str, contr
     return contributor_data, contributor_avg
 
 
+@github_router.get("/rate-limit")
+async def getRateLimit(user_id=Depends(get_current_user)):
+    token = getGitToken(user_id)
+    if token:
+        return get_github_client().rate_limit_status(token)
+    else:
+        raise HTTPException(status_code=400, detail="Github not connected")
+
+
+@github_router.get("/cache-stats")
+async def getCacheStats():
+    return {"githubResponses": get_github_client().cache_stats(), "commitDetails": commit_store_stats(),
+            "repos": repos_cache.stats()}
+
+
 @github_router.patch("/analysis/remove-issue")
 async def RemoveFileIssue():
     return True
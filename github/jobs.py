@@ -0,0 +1,188 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+from .repo_update import update_repository
+
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", 2))
+FINISHED_JOBS_KEPT = int(os.getenv("FINISHED_JOBS_KEPT", 200))
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", 15))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    def __init__(self, repoOwner: str, repoName: str, user_id: str):
+        self.id = uuid.uuid4().hex
+        self.repoOwner = repoOwner
+        self.repoName = repoName
+        self.user_id = user_id
+        self.status = QUEUED
+        self.commits = 0
+        self.files = 0
+        self.rows = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.metrics: Optional[dict] = None
+        self._subscribers = []
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def publish(self, event: dict):
+        if event["event"] == "progress":
+            self.commits, self.files, self.rows = event["commits"], event["files"], event["rows"]
+        elif event["event"] == "metrics":
+            self.metrics = {key: value for key, value in event.items() if key != "event"}
+
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    async def events(self, heartbeat: float = EVENT_HEARTBEAT_SECONDS):
+        # Yields the job's current state, then every event it publishes until it finishes. None is yielded when
+        # nothing has happened for `heartbeat` seconds so streaming responses can keep the connection alive.
+        queue = asyncio.Queue()
+        self._subscribers.append(queue)
+        try:
+            yield {"event": "status", **self.to_dict()}
+            if self.metrics:
+                yield {"event": "metrics", **self.metrics}
+            if self.finished:
+                yield {"event": self.status, **self.to_dict()}
+                return
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+
+                yield event
+                if event["event"] in (DONE, FAILED):
+                    return
+        finally:
+            self._subscribers.remove(queue)
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        return {
+            "jobId": self.id,
+            "repoOwner": self.repoOwner,
+            "repoName": self.repoName,
+            "status": self.status,
+            "commits": self.commits,
+            "files": self.files,
+            "rows": self.rows,
+            "error": self.error,
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+            "queuedSeconds": round((self.started_at or end) - self.created_at, 3),
+            "runSeconds": round(end - self.started_at, 3) if self.started_at else None,
+            "metrics": self.metrics,
+        }
+
+
+class JobManager:
+    # Runs repository updates in the background. Only one job per repository runs at a time: submitting a repository
+    # that is already queued or running returns the existing job instead of crawling it again. `runner` is an async
+    # generator of progress events, which are republished to anyone watching the job.
+    def __init__(self, runner, max_concurrent_jobs: int = MAX_CONCURRENT_JOBS):
+        self.runner = runner
+        self.jobs = OrderedDict()
+        self._active = {}
+        self._slots = asyncio.Semaphore(max(1, max_concurrent_jobs))
+
+    @staticmethod
+    def _key(repoOwner: str, repoName: str):
+        # GitHub owner and repository names are case insensitive
+        return repoOwner.lower(), repoName.lower()
+
+    def submit(self, repoOwner: str, repoName: str, user_id: str):
+        key = self._key(repoOwner, repoName)
+        if key in self._active:
+            return self._active[key], False
+
+        job = Job(repoOwner, repoName, user_id)
+        self.jobs[job.id] = job
+        self._active[key] = job
+        job.task = asyncio.create_task(self._run(job, key))
+        self._prune()
+        return job, True
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def active_job(self, repoOwner: str, repoName: str):
+        return self._active.get(self._key(repoOwner, repoName))
+
+    async def wait(self, job: Job):
+        # asyncio.wait never cancels what it waits on, so a client disconnecting from a waiting request doesn't cancel
+        # the shared job. It doesn't raise the job's error either: the outcome is read from job.status and job.error.
+        await asyncio.wait([job.task])
+        return job
+
+    async def _run(self, job: Job, key):
+        try:
+            async with self._slots:
+                job.status = RUNNING
+                job.started_at = time.time()
+                async for event in self.runner(job.repoOwner, job.repoName, job.user_id):
+                    job.publish(event)
+            job.status = DONE
+        except asyncio.CancelledError:
+            job.status = FAILED
+            job.error = "cancelled"
+            raise
+        except Exception as e:
+            job.status = FAILED
+            job.error = getattr(e, "detail", None) or str(e)
+        except BaseException as e:
+            # e.g. a BaseExceptionGroup escaping the runner: the job must still finish, or it would report "running"
+            # forever and its event streams would never end
+            job.status = FAILED
+            job.error = repr(e)
+            if isinstance(e, (KeyboardInterrupt, SystemExit)):
+                raise
+        finally:
+            job.finished_at = time.time()
+            self._active.pop(key, None)
+            job.publish({"event": job.status, **job.to_dict()})
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self.jobs[job_id]
+
+    async def shutdown(self):
+        tasks = [job.task for job in self._active.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+_manager: Optional[JobManager] = None
+
+
+def get_job_manager():
+    global _manager
+    if _manager is None:
+        _manager = JobManager(update_repository)
+    return _manager
+
+
+async def shutdown_job_manager():
+    global _manager
+    if _manager is not None:
+        manager, _manager = _manager, None
+        await manager.shutdown()
@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import math
+import os
+import random
+import time
+from typing import Optional
+
+GITHUB_MAX_CONCURRENCY = int(os.getenv("GITHUB_MAX_CONCURRENCY", 16))
+GITHUB_RATE_LIMIT_RESERVE = int(os.getenv("GITHUB_RATE_LIMIT_RESERVE", 50))
+GITHUB_MAX_RETRIES = int(os.getenv("GITHUB_MAX_RETRIES", 5))
+GITHUB_BACKOFF_BASE = float(os.getenv("GITHUB_BACKOFF_BASE", 1.0))
+GITHUB_BACKOFF_MAX = float(os.getenv("GITHUB_BACKOFF_MAX", 60.0))
+
+
+class TokenScheduler:
+    # Tracks one token's rate-limit budget from GitHub's response headers. Concurrency shrinks in proportion to the
+    # remaining budget, and once only the reserve is left requests queue until the window resets instead of failing.
+    def __init__(self, max_concurrency: int = GITHUB_MAX_CONCURRENCY, reserve: int = GITHUB_RATE_LIMIT_RESERVE):
+        self.max_concurrency = max(1, max_concurrency)
+        self.reserve = reserve
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset_at: Optional[float] = None
+        self.blocked_until = 0.0
+        self.in_flight = 0
+        self.queued = 0
+        self.throttled = 0
+        self._condition = asyncio.Condition()
+
+    def concurrency(self):
+        if self.remaining is None or not self.limit:
+            return self.max_concurrency
+        return max(1, min(self.max_concurrency, math.ceil(self.max_concurrency * self.remaining / self.limit)))
+
+    def _delay(self):
+        now = time.time()
+        delay = self.blocked_until - now
+
+        if self.remaining is not None and self.remaining - self.in_flight <= self.reserve and self.reset_at:
+            if self.reset_at > now:
+                delay = max(delay, self.reset_at - now)
+            else:
+                # the window has reset; let one request through to learn the new budget
+                self.remaining = None
+
+        return max(0.0, delay)
+
+    async def acquire(self):
+        async with self._condition:
+            self.queued += 1
+            try:
+                while True:
+                    delay = self._delay()
+                    if delay > 0:
+                        try:
+                            await asyncio.wait_for(self._condition.wait(), delay)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+
+                    if self.in_flight < self.concurrency():
+                        break
+                    await self._condition.wait()
+            finally:
+                self.queued -= 1
+            self.in_flight += 1
+
+    async def release(self, headers=None):
+        async with self._condition:
+            self.in_flight -= 1
+            if headers is not None:
+                self.update(headers)
+            self._condition.notify_all()
+
+    def update(self, headers):
+        if "X-RateLimit-Remaining" in headers:
+            self.remaining = int(headers["X-RateLimit-Remaining"])
+        if "X-RateLimit-Limit" in headers:
+            self.limit = int(headers["X-RateLimit-Limit"])
+        if "X-RateLimit-Reset" in headers:
+            self.reset_at = float(headers["X-RateLimit-Reset"])
+
+    def backoff(self, response, attempt: int):
+        # Works out how long to pause this token after a primary or secondary rate limit response
+        self.throttled += 1
+        if "Retry-After" in response.headers:
+            delay = float(response.headers["Retry-After"])
+        elif response.headers.get("X-RateLimit-Remaining") == "0" and "X-RateLimit-Reset" in response.headers:
+            delay = float(response.headers["X-RateLimit-Reset"]) - time.time()
+        else:
+            delay = min(GITHUB_BACKOFF_MAX, GITHUB_BACKOFF_BASE * 2 ** attempt)
+        delay = max(0.0, delay) * random.uniform(1.0, 1.25)
+
+        self.blocked_until = max(self.blocked_until, time.time() + delay)
+        return delay
+
+    def status(self):
+        return {
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "resetAt": self.reset_at,
+            "concurrency": self.concurrency(),
+            "inFlight": self.in_flight,
+            "queued": self.queued,
+            "throttled": self.throttled,
+            "blockedForSeconds": round(max(0.0, self.blocked_until - time.time()), 2),
+        }
+
+
+def is_rate_limited(response):
+    if response.status_code == 429:
+        return True
+    if response.status_code != 403:
+        return False
+    return ("Retry-After" in response.headers
+            or response.headers.get("X-RateLimit-Remaining") == "0"
+            or b"rate limit" in response.content.lower())
+
+
+class RateLimitScheduler:
+    def __init__(self, max_concurrency: int = GITHUB_MAX_CONCURRENCY, max_retries: int = GITHUB_MAX_RETRIES):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._tokens = {}
+
+    def for_token(self, token: str):
+        key = hashlib.sha256(token.encode()).hexdigest()
+        if key not in self._tokens:
+            self._tokens[key] = TokenScheduler(self.max_concurrency)
+        return self._tokens[key]
+
+    async def send(self, token: str, send):
+        scheduler = self.for_token(token)
+        attempt = 0
+
+        while True:
+            await scheduler.acquire()
+            response = None
+            try:
+                response = await send()
+            finally:
+                await scheduler.release(response.headers if response is not None else None)
+
+            if not is_rate_limited(response) or attempt >= self.max_retries:
+                return response
+
+            scheduler.backoff(response, attempt)
+            attempt += 1
+
+    def status(self, token: str):
+        return self.for_token(token).status()
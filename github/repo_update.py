@@ -0,0 +1,155 @@
+import os
+import time
+from typing import Optional
+from contextlib import aclosing
+from fastapi import HTTPException
+from analysis_pool import AnalysisExecutor, get_analysis_executor
+from database import getGitToken, setLastAnalysedTime, CommitAnalysisWriter, get_sync_watermark, \
+    set_sync_watermark, get_seen_commits, get_repo_analysis_summary
+from .github_api import get_branch_head, iter_new_commit_shas, fetch_commit_details_concurrently
+from .git_mirror import update_mirror, resolve_branch, has_commit, iter_commit_patches
+
+# where update_repository reads commits from: "api" (one GitHub call per commit) or "git" (a local mirror)
+REPO_UPDATE_BACKEND = os.getenv("REPO_UPDATE_BACKEND", "api")
+
+
+def repository_metrics(repoOwner: str, repoName: str):
+    # The overview's repository-wide averages and grades over every row stored so far, including those this update
+    # has flushed. Published while the update runs, so they are the same figures the overview will show.
+    summary = get_repo_analysis_summary(repoOwner, repoName)
+    return {
+        "averageComplexity": summary["avg_complexity"],
+        "averageComplexityGrade": summary["complexity_grade"],
+        "averageCommentRatio": summary["avg_ltc_ratio"],
+        "averageCommentRatioGrade": summary["comment_grade"],
+        "averageMaintainability": summary["avg_maintain_index"],
+        "averageMaintainabilityGrade": summary["maintainability_grade"],
+        "fileCount": summary["files"],
+    }
+
+
+async def analyse_and_write(executor: AnalysisExecutor, writer: CommitAnalysisWriter, repoOwner: str, repoName: str,
+                            pending: list, pending_commits: list):
+    results = await executor.analyse([(file.filename, file.patch) for _, _, file in pending])
+
+    for (sha, author, file), (cc, mi, ltc) in zip(pending, results):
+        if cc is None and mi is None and ltc is None:
+            continue
+
+        writer.add(
+            repoOwner,
+            repoName,
+            sha,
+            author.name,
+            file.filename,
+            cc,
+            mi,
+            ltc,
+            author.date
+        )
+
+    # every file of these commits has now been handed to the writer
+    for sha in pending_commits:
+        writer.mark_seen(repoOwner, repoName, sha)
+
+
+def progress_event(started: float, commits: int, files: int, rows: int):
+    elapsed = max(time.perf_counter() - started, 1e-6)
+    return {
+        "event": "progress",
+        "commits": commits,
+        "files": files,
+        "rows": rows,
+        "commitsPerSecond": round(commits / elapsed, 2),
+        "filesPerSecond": round(files / elapsed, 2),
+    }
+
+
+async def api_commits(repoOwner: str, repoName: str, token: str, head_sha: str, base_sha: Optional[str], seen: set):
+    # (sha, author, files) for each new commit, fetched one REST call per commit
+    commit_shas = (sha async for sha in iter_new_commit_shas(repoOwner, repoName, token, head_sha, base_sha)
+                   if sha not in seen)
+
+    # commits are analysed as soon as their details arrive, while later listing pages are still downloading
+    fetched = fetch_commit_details_concurrently(commit_shas, repoOwner, repoName, token)
+    async with aclosing(fetched):
+        async for sha, commitChanges in fetched:
+            if isinstance(commitChanges, Exception):
+                raise commitChanges
+            yield sha, commitChanges.commit.author, commitChanges.files
+
+
+async def git_commits(path: str, head_sha: str, base_sha: Optional[str], seen: set):
+    # (sha, author, files) for each new commit, streamed from `git log -p` over the local mirror
+    if base_sha is not None and not await has_commit(path, base_sha):
+        base_sha = None
+
+    async with aclosing(iter_commit_patches(path, head_sha, base_sha)) as log:
+        async for commit in log:
+            if commit.sha not in seen:
+                yield commit.sha, commit.author, commit.files
+
+
+async def update_repository(repoOwner: str, repoName: str, user_id: str, branch: Optional[str] = None,
+                            backend: Optional[str] = None):
+    # Fetches, analyses and stores every commit on the branch that has not been analysed before. This is an async
+    # generator of progress events: one per fetched commit, and a `metrics` event with the repository's averages
+    # after each batch of rows is written. Progress is tracked by commit sha rather than by time: the branch's last
+    # analysed head is the base of a compare, and any commit already seen (on any branch, or before an interrupted
+    # run) is skipped.
+    # The "api" backend downloads each commit from GitHub; "git" streams them from a local mirror of the repository.
+    token = getGitToken(user_id)
+    if not token:
+        raise HTTPException(status_code=400, detail="Github not connected")
+
+    backend = backend or REPO_UPDATE_BACKEND
+    if backend not in ("api", "git"):
+        raise HTTPException(status_code=400, detail=f"Unknown update backend {backend}")
+
+    started = time.perf_counter()
+    if backend == "git":
+        path = await update_mirror(repoOwner, repoName, token)
+        branch, head_sha = await resolve_branch(path, branch)
+    else:
+        branch, head_sha = await get_branch_head(repoOwner, repoName, token, branch, cache_user=user_id)
+    base_sha = get_sync_watermark(repoOwner, repoName, branch)
+    executor = get_analysis_executor()
+    commits = files = 0
+    pending = []
+    pending_commits = []
+
+    if base_sha != head_sha:
+        seen = get_seen_commits(repoOwner, repoName)
+        if backend == "git":
+            new_commits = git_commits(path, head_sha, base_sha, seen)
+        else:
+            new_commits = api_commits(repoOwner, repoName, token, head_sha, base_sha, seen)
+
+        async with aclosing(new_commits):
+            with CommitAnalysisWriter() as writer:
+                async for sha, author, commit_files in new_commits:
+                    commits += 1
+                    pending += [(sha, author, file) for file in commit_files]
+                    pending_commits.append(sha)
+
+                    if len(pending) >= executor.chunk_size * max(1, executor.workers):
+                        flushes = writer.flushes
+                        await analyse_and_write(executor, writer, repoOwner, repoName, pending, pending_commits)
+                        files += len(pending)
+                        pending = []
+                        pending_commits = []
+                        if writer.flushes != flushes:
+                            yield {"event": "metrics", **repository_metrics(repoOwner, repoName)}
+
+                    yield progress_event(started, commits, files, writer.rows_written)
+
+                await analyse_and_write(executor, writer, repoOwner, repoName, pending, pending_commits)
+                files += len(pending)
+
+        yield progress_event(started, commits, files, writer.rows_written)
+        yield {"event": "metrics", **repository_metrics(repoOwner, repoName)}
+    else:
+        yield progress_event(started, commits, files, 0)
+
+    set_sync_watermark(repoOwner, repoName, branch, head_sha)
+    setLastAnalysedTime(repoOwner, repoName)
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+REPOS_CACHE_TTL = float(os.getenv("REPOS_CACHE_TTL", 60))
+# how long past the TTL a listing may still be served while a fresh one is fetched in the background
+REPOS_CACHE_STALE_TTL = float(os.getenv("REPOS_CACHE_STALE_TTL", 600))
+REPOS_CACHE_MAX_ENTRIES = int(os.getenv("REPOS_CACHE_MAX_ENTRIES", 1024))
+
+
+class StaleWhileRevalidateCache:
+    # Fresh entries are served as they are. Stale ones are still served, but trigger one background reload; entries
+    # past the stale window (or missing) are loaded before returning. Concurrent loads of one key share a task.
+    def __init__(self, ttl: float = REPOS_CACHE_TTL, stale_ttl: float = REPOS_CACHE_STALE_TTL,
+                 max_entries: int = REPOS_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.counters = {"hits": 0, "stale": 0, "misses": 0, "load_errors": 0}
+        self._entries = OrderedDict()
+        self._loading = {}
+
+    async def get(self, key, loader):
+        entry = self._entries.get(key)
+        age = time.monotonic() - entry[0] if entry else None
+
+        if entry and age < self.ttl:
+            self.counters["hits"] += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+        if entry and age < self.ttl + self.stale_ttl:
+            self.counters["stale"] += 1
+            self._load(key, loader)
+            return entry[1]
+
+        self.counters["misses"] += 1
+        return await asyncio.shield(self._load(key, loader))
+
+    def _load(self, key, loader):
+        task = self._loading.get(key)
+        # a finished task can linger until its done callback runs, so it must not be mistaken for a load in flight
+        if task is None or task.done():
+            task = asyncio.create_task(self._store(key, loader))
+            task.add_done_callback(lambda done: self._loaded(key, done))
+            self._loading[key] = task
+        return task
+
+    async def _store(self, key, loader):
+        value = await loader()
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value
+
+    def _loaded(self, key, task):
+        if self._loading.get(key) is task:
+            del self._loading[key]
+        # a failed background reload keeps serving the stale entry; a foreground caller sees the error itself
+        if not task.cancelled() and task.exception() is not None:
+            self.counters["load_errors"] += 1
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def stats(self):
+        return {**self.counters, "entries": len(self._entries)}
+
+
+repos_cache = StaleWhileRevalidateCache()
@@ -0,0 +1,114 @@
+import re
+import tokenize
+from io import BytesIO
+
+# Token kinds shared by every lexer. Analysis only looks at NAME, NUMBER, OP and TAG; strings, comments and
+# whitespace are recognised so keywords inside them are never counted.
+NAME = "NAME"
+NUMBER = "NUMBER"
+OP = "OP"
+TAG = "TAG"
+STRING = "STRING"
+COMMENT = "COMMENT"
+WHITESPACE = "WHITESPACE"
+OTHER = "OTHER"
+
+SKIPPED_KINDS = frozenset({STRING, COMMENT, WHITESPACE, OTHER})
+
+_PYTHON_KINDS = {
+    tokenize.NAME: NAME,
+    tokenize.NUMBER: NUMBER,
+    tokenize.OP: OP,
+    tokenize.STRING: STRING,
+    tokenize.COMMENT: COMMENT,
+}
+
+
+def python_lexer(code):
+    # Python keeps the standard library tokenizer; it raises on code it can't tokenize
+    for token in tokenize.tokenize(BytesIO(code.encode('utf-8')).readline):
+        kind = _PYTHON_KINDS.get(token.type)
+        if kind is not None:
+            yield kind, token.string
+
+
+class RegexLexer:
+    # Table-driven scanner: `rules` is an ordered list of (kind, pattern) compiled into one alternation, so each
+    # token is found by a single regex match. `compound_keywords` joins pairs such as else + if into one NAME token
+    # and `normalise` rewrites the text of a token kind. Unknown characters are skipped, so scanning never raises.
+    def __init__(self, rules, compound_keywords=None, normalise=None):
+        self.pattern = re.compile("|".join(f"(?P<{kind}>{pattern})" for kind, pattern in rules))
+        self.compound_keywords = compound_keywords or {}
+        self.normalise = normalise or {}
+
+    def __call__(self, code):
+        compound_keywords = self.compound_keywords
+        normalise = self.normalise
+        pending = None
+
+        for match in self.pattern.finditer(code):
+            kind = match.lastgroup
+            if kind in SKIPPED_KINDS:
+                continue
+
+            string = match.group()
+            if kind in normalise:
+                string = normalise[kind](string)
+
+            if pending is not None:
+                if kind == NAME and string == compound_keywords[pending]:
+                    yield NAME, f"{pending} {string}"
+                    pending = None
+                    continue
+                yield NAME, pending
+                pending = None
+
+            if kind == NAME and string in compound_keywords:
+                pending = string
+                continue
+
+            yield kind, string
+
+        if pending is not None:
+            yield NAME, pending
+
+
+_C_LIKE_OPERATORS = (r">>>=|===|!==|>>>|<<=|>>=|\*\*=|\.\.\.|\?\?=|&&=|\|\|=|&&|\|\||\?\?|\?\.|=>|==|!=|<=|>=|"
+                     r"\+\+|--|\+=|-=|\*=|/=|%=|&=|\|=|\^=|<<|>>|\*\*|::|->|[-+*/%=<>!&|^~?:;,.(){}\[\]@]")
+_NUMBER = r"0[xX][0-9a-fA-F_]+[nlL]?|(?:\d[\d_]*\.?[\d_]*|\.\d[\d_]*)(?:[eE][+-]?\d+)?[a-zA-Z]*"
+_LINE_COMMENT = r"//[^\n]*"
+_BLOCK_COMMENT = r"/\*[\s\S]*?(?:\*/|\Z)"
+_DOUBLE_QUOTED = r'"(?:\\.|[^"\\\n])*"?'
+_SINGLE_QUOTED = r"'(?:\\.|[^'\\\n])*'?"
+
+java_lexer = RegexLexer([
+    (WHITESPACE, r"\s+"),
+    (COMMENT, f"{_LINE_COMMENT}|{_BLOCK_COMMENT}"),
+    (STRING, r'"""[\s\S]*?(?:"""|\Z)|' + f"{_DOUBLE_QUOTED}|{_SINGLE_QUOTED}"),
+    (NUMBER, _NUMBER),
+    (NAME, r"[A-Za-z_$][\w$]*"),
+    (OP, _C_LIKE_OPERATORS),
+    (OTHER, r"."),
+], compound_keywords={"else": "if"})
+
+javascript_lexer = RegexLexer([
+    (WHITESPACE, r"\s+"),
+    (COMMENT, f"{_LINE_COMMENT}|{_BLOCK_COMMENT}"),
+    (STRING, f"{_DOUBLE_QUOTED}|{_SINGLE_QUOTED}|" + r"`(?:\\.|[^`\\])*`?"),
+    (NUMBER, _NUMBER),
+    (NAME, r"[A-Za-z_$][\w$]*"),
+    (OP, _C_LIKE_OPERATORS),
+    (OTHER, r"."),
+], compound_keywords={"else": "if"})
+
+html_lexer = RegexLexer([
+    (WHITESPACE, r"\s+"),
+    (COMMENT, r"<!--[\s\S]*?(?:-->|\Z)"),
+    # only attribute values are strings, so apostrophes in text content don't swallow the rest of the file
+    (STRING, r"""=\s*(?:"[^"]*"?|'[^']*'?)"""),
+    (TAG, r"<[A-Za-z][\w:-]*"),
+    (NUMBER, _NUMBER),
+    (NAME, r"[A-Za-z_$][\w$]*"),
+    (OP, r"</|/>|[<>=/*#@:()\[\]{}.!&|?+-]"),
+    (OTHER, r"."),
+], normalise={TAG: lambda tag: tag + ">"})
@@ -1,15 +1,37 @@
 # main.py
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+
+# the app's modules read their settings from the environment as they are imported, so .env must be loaded first
+load_dotenv()
+
 from fastapi import FastAPI
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
-from dotenv import load_dotenv
 from auth import auth_routes
 from users import user_routes
 from github import github_routes
+from github.github_client import start_github_client, close_github_client
+from analysis_pool import start_analysis_executor, shutdown_analysis_executor
+from auth.password_hasher import start_password_hasher, shutdown_password_hasher
+from github.jobs import shutdown_job_manager
 import database
 
-app = FastAPI()
-load_dotenv()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_github_client()
+    start_analysis_executor()
+    start_password_hasher()
+    yield
+    await shutdown_job_manager()
+    shutdown_analysis_executor()
+    shutdown_password_hasher()
+    await close_github_client()
+    database.close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -18,6 +40,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # /github/issues returns its pagination cursor in a header, which browsers hide from scripts unless exposed
+    expose_headers=["X-Next-Cursor"],
 )
 
 
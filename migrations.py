@@ -0,0 +1,185 @@
+from datetime import datetime
+import rollups
+
+# Ordered schema upgrades. Each step is (version, name, statements) where a statement is either a SQL string or a
+# callable taking the connection. Versions are applied once and recorded in schema_version.
+MIGRATIONS = [
+    (1, "create base tables", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT NOT NULL,
+            password TEXT NOT NULL,
+            forename TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS githubTokens (
+            user_id INTEGER UNIQUE,
+            token TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS repoLastAnalysed (
+            repo_owner TEXT,
+            repo_name TEXT,
+            last_updated DATETIME,
+            PRIMARY KEY (repo_owner, repo_name)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS commitFileAnalysis (
+            repo_owner TEXT,
+            repo_name TEXT,
+            commit_sha TEXT,
+            author TEXT,
+            filename TEXT,
+            complexity INTEGER,
+            maintain_index FLOAT,
+            ltc_ratio FLOAT,
+            commit_date DATETIME,
+            PRIMARY KEY (commit_sha, filename, repo_owner, repo_name)
+        )
+        """,
+    ]),
+    (2, "index commit analysis by repo, author and date", [
+        # covers the contributor list and both contributor report queries without touching the table
+        """
+        CREATE INDEX IF NOT EXISTS idx_analysis_repo_author_date
+        ON commitFileAnalysis (repo_owner, repo_name, author, commit_date, commit_sha, complexity, maintain_index,
+                               ltc_ratio)
+        """,
+    ]),
+    (3, "index commit analysis by repo and complexity", [
+        "CREATE INDEX IF NOT EXISTS idx_analysis_repo_complexity ON commitFileAnalysis (repo_owner, repo_name, complexity)",
+    ]),
+    (4, "index users by email", [
+        "CREATE INDEX IF NOT EXISTS idx_users_email ON users (email)",
+    ]),
+    (5, "create github response cache", [
+        """
+        CREATE TABLE IF NOT EXISTS githubResponseCache (
+            user_id TEXT,
+            url TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            body BLOB,
+            fetched_at DATETIME,
+            PRIMARY KEY (user_id, url)
+        )
+        """,
+    ]),
+    (6, "create commit details store", [
+        """
+        CREATE TABLE IF NOT EXISTS commitDetailsStore (
+            repo_owner TEXT,
+            repo_name TEXT,
+            sha TEXT,
+            payload BLOB,
+            size INTEGER,
+            last_access REAL,
+            PRIMARY KEY (repo_owner, repo_name, sha)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_commit_details_last_access ON commitDetailsStore (last_access, size)",
+    ]),
+    (7, "index commit analysis by each sortable column", [
+        "CREATE INDEX IF NOT EXISTS idx_analysis_repo_maintain_index ON commitFileAnalysis (repo_owner, repo_name, "
+        "maintain_index)",
+        "CREATE INDEX IF NOT EXISTS idx_analysis_repo_ltc_ratio ON commitFileAnalysis (repo_owner, repo_name, ltc_ratio)",
+        "CREATE INDEX IF NOT EXISTS idx_analysis_repo_date ON commitFileAnalysis (repo_owner, repo_name, commit_date)",
+    ]),
+    (8, "create incrementally maintained repository summary", [
+        rollups.REPO_SUMMARY.table_sql(),
+        *rollups.REPO_SUMMARY.triggers(),
+        rollups.REPO_SUMMARY.rebuild,
+    ]),
+    (9, "create incrementally maintained contributor rollups", [
+        rollups.CONTRIBUTOR_DAILY.table_sql(),
+        *rollups.CONTRIBUTOR_DAILY.triggers(),
+        rollups.CONTRIBUTOR_DAILY.rebuild,
+        rollups.CONTRIBUTOR_MONTHLY.table_sql(),
+        *rollups.CONTRIBUTOR_MONTHLY.triggers(),
+        rollups.CONTRIBUTOR_MONTHLY.rebuild,
+    ]),
+    (10, "create sync watermarks and seen commits", [
+        """
+        CREATE TABLE IF NOT EXISTS repoSyncWatermark (
+            repo_owner TEXT,
+            repo_name TEXT,
+            branch TEXT,
+            head_sha TEXT,
+            updated_at DATETIME,
+            PRIMARY KEY (repo_owner, repo_name, branch)
+        )
+        """,
+        # commits are immutable, so a commit analysed on any branch never needs analysing again
+        """
+        CREATE TABLE IF NOT EXISTS repoSeenCommits (
+            repo_owner TEXT,
+            repo_name TEXT,
+            sha TEXT,
+            PRIMARY KEY (repo_owner, repo_name, sha)
+        )
+        """,
+        """
+        INSERT OR IGNORE INTO repoSeenCommits (repo_owner, repo_name, sha)
+        SELECT DISTINCT repo_owner, repo_name, commit_sha FROM commitFileAnalysis
+        """,
+    ]),
+    (11, "store github response headers", [
+        "ALTER TABLE githubResponseCache ADD COLUMN headers TEXT",
+        # entries cached without their headers can't be replayed faithfully, so they are fetched again
+        "DELETE FROM githubResponseCache",
+    ]),
+    (12, "index contributor commit identities", [
+        # the contributorDaily triggers count an author's rows for one commit and day on every write; seeking on the
+        # sha keeps that to the commit's own files instead of every row the author has. commit_date makes it covering.
+        "CREATE INDEX IF NOT EXISTS idx_analysis_repo_author_sha ON commitFileAnalysis (repo_owner, repo_name, author, "
+        "commit_sha, commit_date)",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn, target: int = LATEST_VERSION):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at DATETIME
+        )
+    """)
+    conn.commit()
+
+    for version, name, statements in MIGRATIONS:
+        if version > target:
+            break
+
+        # BEGIN IMMEDIATE takes the write lock so two workers starting together can't apply the same step twice
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= get_schema_version(conn):
+                conn.rollback()
+                continue
+
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+
+            conn.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                         (version, name, datetime.now()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return get_schema_version(conn)
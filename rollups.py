@@ -0,0 +1,146 @@
+# Aggregates kept alongside commitFileAnalysis. Triggers on the analysis table keep each rollup in step with every
+# insert, upsert and delete, so they are always written in the same transaction as the rows they summarise.
+
+
+# Grade buckets as SQL, mirroring the thresholds of grade_complexity, grade_maintainability and grade_comment_ratio in
+# utils.py. Each branch relies on the earlier ones having failed, exactly like the if/elif chains they copy.
+def complexity_grade_sql(expression: str):
+    return (f"CASE WHEN {expression} IS NULL THEN NULL WHEN {expression} <= 10 THEN 'A' WHEN {expression} < 21 THEN 'B' "
+            f"WHEN {expression} < 41 THEN 'C' ELSE 'F' END")
+
+
+def maintainability_grade_sql(expression: str):
+    return (f"CASE WHEN {expression} IS NULL THEN NULL WHEN {expression} <= 50 THEN 'A' WHEN {expression} <= 70 THEN 'B' "
+            f"WHEN {expression} <= 85 THEN 'C' ELSE 'F' END")
+
+
+def comment_ratio_grade_sql(expression: str):
+    return (f"CASE WHEN {expression} IS NULL THEN NULL WHEN {expression} <= 0.1 THEN 'F' WHEN {expression} < 0.3 THEN 'B' "
+            f"ELSE 'A' END")
+
+
+GRADE_LETTERS = ("A", "B", "C", "F")
+COMMENT_GRADE_LETTERS = ("A", "B", "F")
+
+
+def _histogram_counters(name, grade_sql, column, letters):
+    return [(f"{name}_{letter.lower()}", f"COALESCE({grade_sql('{row}.' + column)} = '{letter}', 0)")
+            for letter in letters]
+
+
+# Per-metric running sums and counts; averages are sum / files so NULL metrics are skipped just like AVG skips them.
+# Each entry is rollup column -> one row's contribution, with {row} standing for NEW, OLD or the table itself.
+METRIC_COUNTERS = [
+    ("files", "1"),
+    ("complexity_files", "{row}.complexity IS NOT NULL"),
+    ("complexity_sum", "COALESCE({row}.complexity, 0)"),
+    ("ltc_ratio_files", "{row}.ltc_ratio IS NOT NULL"),
+    ("ltc_ratio_sum", "COALESCE({row}.ltc_ratio, 0)"),
+    ("maintain_index_files", "{row}.maintain_index IS NOT NULL"),
+    ("maintain_index_sum", "COALESCE({row}.maintain_index, 0)"),
+]
+
+
+class Rollup:
+    # A table of counters grouped by keys, kept in step with commitFileAnalysis by AFTER INSERT/UPDATE/DELETE
+    # triggers. distinct optionally names a column counting distinct identities (e.g. commits) rather than rows:
+    # (column, identity templates); a row adds one when it is the first of its identity and removes one when last.
+    def __init__(self, name, table, keys, counters, distinct=None):
+        self.name = name
+        self.table = table
+        self.keys = keys
+        self.counters = counters
+        self.distinct = distinct
+
+    def table_sql(self):
+        columns = [f"{column} TEXT" for column, _ in self.keys]
+        columns += [f"{column} {'REAL' if column.endswith('_sum') else 'INTEGER'} NOT NULL DEFAULT 0"
+                    for column, _ in self.counters]
+        if self.distinct:
+            columns.append(f"{self.distinct[0]} INTEGER NOT NULL DEFAULT 0")
+        return (f"CREATE TABLE IF NOT EXISTS {self.table} ({', '.join(columns)}, "
+                f"PRIMARY KEY ({', '.join(column for column, _ in self.keys)}))")
+
+    def _identity_match(self):
+        return " AND ".join(f"{template.format(row='commitFileAnalysis')} IS {template}" for template in self.distinct[1])
+
+    def _apply_sql(self, row, sign, distinct_sql=None):
+        # adds (sign "+") or removes (sign "-") one analysis row's contribution to its rollup row
+        counters = list(self.counters)
+        if distinct_sql:
+            counters.append((self.distinct[0], distinct_sql))
+
+        columns = [column for column, _ in self.keys] + [column for column, _ in counters]
+        values = [template.format(row=row) for _, template in self.keys]
+        values += [f"{sign}({template.format(row=row)})" for _, template in counters]
+        return (f"INSERT INTO {self.table} ({', '.join(columns)}) VALUES ({', '.join(values)}) "
+                f"ON CONFLICT({', '.join(column for column, _ in self.keys)}) DO UPDATE SET "
+                + ", ".join(f"{column} = {column} + excluded.{column}" for column, _ in counters))
+
+    def triggers(self):
+        first, last, moved = None, None, None
+        if self.distinct:
+            match = self._identity_match()
+            first = f"(SELECT COUNT(*) FROM commitFileAnalysis WHERE {match}) = 1"
+            last = f"NOT EXISTS (SELECT 1 FROM commitFileAnalysis WHERE {match})"
+            # an update that keeps the identity must not count it again
+            moved = first + " AND NOT (" + " AND ".join(
+                f"{template.format(row='NEW')} IS {template.format(row='OLD')}" for template in self.distinct[1]) + ")"
+
+        return [
+            f"CREATE TRIGGER IF NOT EXISTS trg_{self.name}_insert AFTER INSERT ON commitFileAnalysis BEGIN "
+            f"{self._apply_sql('NEW', '+', first)}; END",
+            f"CREATE TRIGGER IF NOT EXISTS trg_{self.name}_delete AFTER DELETE ON commitFileAnalysis BEGIN "
+            f"{self._apply_sql('OLD', '-', last)}; END",
+            f"CREATE TRIGGER IF NOT EXISTS trg_{self.name}_update AFTER UPDATE ON commitFileAnalysis BEGIN "
+            f"{self._apply_sql('OLD', '-', last)}; {self._apply_sql('NEW', '+', moved)}; END",
+        ]
+
+    def rebuild(self, conn, repo_owner: str = None, repo_name: str = None):
+        # Recomputes the rollup from commitFileAnalysis for one repository, or for all of them when none is given.
+        # Also clears the float drift running sums pick up over many upserts.
+        where, params = "", ()
+        if repo_owner is not None and repo_name is not None:
+            where, params = "WHERE repo_owner=? AND repo_name=?", (repo_owner, repo_name)
+
+        columns = [column for column, _ in self.keys] + [column for column, _ in self.counters]
+        values = [template.format(row="commitFileAnalysis") for _, template in self.keys]
+        values += [f"SUM({template.format(row='commitFileAnalysis')})" for _, template in self.counters]
+        if self.distinct:
+            columns.append(self.distinct[0])
+            values.append("COUNT(DISTINCT " + " || char(0) || ".join(
+                f"IFNULL({template.format(row='commitFileAnalysis')}, '')" for template in self.distinct[1]) + ")")
+
+        conn.execute(f"DELETE FROM {self.table} {where}", params)
+        conn.execute(f"INSERT INTO {self.table} ({', '.join(columns)}) SELECT {', '.join(values)} "
+                     f"FROM commitFileAnalysis {where} GROUP BY {', '.join(values[:len(self.keys)])}", params)
+
+
+REPO_KEYS = [("repo_owner", "{row}.repo_owner"), ("repo_name", "{row}.repo_name")]
+# NULL keys never conflict, so a missing author or date is grouped under '' instead
+AUTHOR_KEY = ("author", "IFNULL({row}.author, '')")
+
+REPO_SUMMARY = Rollup("repo_summary", "repoSummary", REPO_KEYS, METRIC_COUNTERS + [
+    *_histogram_counters("complexity", complexity_grade_sql, "complexity", GRADE_LETTERS),
+    *_histogram_counters("comment", comment_ratio_grade_sql, "ltc_ratio", COMMENT_GRADE_LETTERS),
+    *_histogram_counters("maintainability", maintainability_grade_sql, "maintain_index", GRADE_LETTERS),
+])
+
+CONTRIBUTOR_DAILY = Rollup(
+    "contributor_daily", "contributorDaily",
+    REPO_KEYS + [AUTHOR_KEY, ("day", "IFNULL(DATE({row}.commit_date), '')")],
+    METRIC_COUNTERS,
+    distinct=("commits", ["{row}.commit_sha", "{row}.repo_owner", "{row}.repo_name", "{row}.author",
+                          "DATE({row}.commit_date)"]))
+
+CONTRIBUTOR_MONTHLY = Rollup(
+    "contributor_monthly", "contributorMonthly",
+    REPO_KEYS + [AUTHOR_KEY, ("month", "IFNULL(strftime('%Y-%m', {row}.commit_date), '')")],
+    METRIC_COUNTERS)
+
+ROLLUPS = [REPO_SUMMARY, CONTRIBUTOR_DAILY, CONTRIBUTOR_MONTHLY]
+
+
+def rebuild_rollups(conn, repo_owner: str = None, repo_name: str = None):
+    for rollup in ROLLUPS:
+        rollup.rebuild(conn, repo_owner, repo_name)
@@ -0,0 +1,127 @@
+import asyncio
+import time
+import pytest
+from analysis import analyse_files, analyze_patch, calculate_cyclomatic_complexity, \
+    calculate_lines_to_comments_ratio, calculate_maintainability_index, calculate_halstead_volume, parse_github_patch, \
+    LANGUAGE_TABLES, PatchMetrics, register_language
+from analysis_pool import AnalysisExecutor
+
+PYTHON_PATCH = """@@ -1,3 +1,12 @@
++# totals the values
++def total(values):
++    result = 0
++    for value in values:
++        if value > 0 and value < 100:
++            result += value
++        elif value < 0:
++            result -= value
++    return result
+ unchanged = True
+-removed = False
+"""
+
+FILES = [("main.py", PYTHON_PATCH), ("README.md", "+hello"), ("broken.py", "+def f(:\n+  ("), ("app.js", "+let a = 1;")]
+
+
+def test_analyse_files_matches_individual_metrics():
+    expected = []
+    for filename, patch in FILES:
+        cc = calculate_cyclomatic_complexity(patch, filename)
+        expected.append((cc, calculate_maintainability_index(patch, filename, cc),
+                         calculate_lines_to_comments_ratio(patch, filename)))
+
+    assert analyse_files(FILES) == expected
+    assert expected[0][0] == 6
+
+
+def test_analysis_executor_batches_across_processes():
+    executor = AnalysisExecutor(workers=2, chunk_size=3)
+    try:
+        results = asyncio.run(executor.analyse(FILES * 5))
+    finally:
+        executor.shutdown()
+
+    assert results == analyse_files(FILES) * 5
+
+
+def test_analyze_patch_computes_every_metric_in_one_pass():
+    metrics = analyze_patch(PYTHON_PATCH, "main.py")
+
+    assert metrics.complexity == calculate_cyclomatic_complexity(PYTHON_PATCH, "main.py") == 6
+    assert metrics.ltc_ratio == calculate_lines_to_comments_ratio(PYTHON_PATCH, "main.py")
+    assert metrics.maintain_index == calculate_maintainability_index(PYTHON_PATCH, "main.py", 6)
+    assert metrics.loc == 9
+    assert metrics.comment_lines == 1
+    assert metrics.halstead_volume == calculate_halstead_volume(parse_github_patch(PYTHON_PATCH),
+                                                                 LANGUAGE_TABLES["py"].halstead_excluded)
+
+
+def test_analyze_patch_handles_unsupported_and_missing_patches():
+    assert analyze_patch("+hello", "README.md") == PatchMetrics()
+    assert analyze_patch(None, "main.py") == PatchMetrics()
+    assert analyze_patch("+<div></div>\n+<p></p>\n+<!-- x -->", "index.html").maintain_index is None
+
+
+JAVA_PATCH = """+public class Totals {
++    // if this were a loop it would count
++    String label = "while for if";
++    int total(int[] values) {
++        int result = 0;
++        for (int value : values) {
++            if (value > 0) { result += value; } else if (value < 0) { result -= value; }
++        }
++        return result;
++    }
++}"""
+
+JS_PATCH = """+function check(a, b) {
++  /* if (a) { } */
++  const label = `while ${a}`;
++  if (a && !b) { return 1; }
++  return a || b;
++}"""
+
+HTML_PATCH = """+<div *ngIf="items && items.length" (click)="toggle()">
++  <!-- <for> is commented out -->
++  <p>Don't count if or else here</p>
++  <button onclick="save()">Save</button>
++</div>"""
+
+
+def test_regex_lexers_ignore_keywords_in_strings_and_comments():
+    assert calculate_cyclomatic_complexity(JAVA_PATCH, "Totals.java") == 5
+    assert calculate_cyclomatic_complexity(JS_PATCH, "check.js") == 8
+    assert calculate_cyclomatic_complexity(JS_PATCH, "check.ts") == 8
+    assert calculate_cyclomatic_complexity(HTML_PATCH, "list.html") == 3
+    assert calculate_maintainability_index(JAVA_PATCH, "Totals.java", 5) is not None
+    # Python's tokenize gives up on unterminated template literals
+    assert calculate_cyclomatic_complexity("+const a = `multi\n+line", "a.js") == 1
+
+
+def test_register_language_adds_a_lexer():
+    from lexers import RegexLexer, NAME, OP, WHITESPACE, COMMENT, OTHER
+    lua_lexer = RegexLexer([(WHITESPACE, r"\s+"), (COMMENT, r"--[^\n]*"), (NAME, r"[A-Za-z_]\w*"),
+                            (OP, r"[=<>~]=|[-+*/=<>()]"), (OTHER, r".")])
+    register_language(["lua"], lua_lexer, ["if", "elseif", "while", "and"], ["--"], {"local", "end", "then"})
+    try:
+        assert calculate_cyclomatic_complexity("+if a and b then\n+  -- while\n+end", "init.lua") == 3
+    finally:
+        del LANGUAGE_TABLES["lua"]
+
+
+@pytest.mark.parametrize("filename, patch", [
+    ("main.py", PYTHON_PATCH), ("Totals.java", JAVA_PATCH), ("check.ts", JS_PATCH), ("list.html", HTML_PATCH)
+])
+def test_lexer_throughput(filename, patch):
+    table = LANGUAGE_TABLES[filename.split(".")[-1]]
+    code = parse_github_patch(patch) + "\n"
+    source = code * max(1, (512 * 1024) // len(code))
+
+    started = time.perf_counter()
+    tokens = sum(1 for _ in table.lexer(source))
+    elapsed = time.perf_counter() - started
+
+    # reported for comparison (pytest -s) rather than asserted, since wall-clock speed depends on the machine
+    throughput = len(source) / (1024 * 1024) / elapsed
+    print(f"{filename.split('.')[-1]}: {throughput:.1f} MB/s ({tokens} tokens)")
+    assert tokens > 0
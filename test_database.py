@@ -0,0 +1,265 @@
+import pytest
+import database
+import rollups
+import utils
+from fastapi import HTTPException
+
+
+@pytest.fixture
+def db(tmp_path):
+    database.init_pool(str(tmp_path / "test.db"), size=2)
+    database.create_db()
+    yield database
+    database.close_pool()
+
+
+def test_pool_reuses_connections(db):
+    for _ in range(10):
+        db.getUser(1)
+
+    stats = db.get_pool_stats()
+    assert stats["open"] == 1
+    assert stats["checkedOut"] == 0
+    assert stats["checkouts"] >= 10
+
+
+def test_pool_applies_pragmas(db):
+    with db.db_connection() as (conn, cursor):
+        assert cursor.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert cursor.execute("PRAGMA synchronous").fetchone()[0] == 1
+
+
+def test_pool_rolls_back_on_error(db):
+    with pytest.raises(RuntimeError):
+        with db.db_connection() as (conn, cursor):
+            cursor.execute("INSERT INTO users (email, password, forename) VALUES ('a', 'b', 'c')")
+            raise RuntimeError()
+
+    with db.db_connection() as (conn, cursor):
+        assert cursor.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0
+
+
+def _analysis_row(sha, filename, complexity=1):
+    return "owner", "repo", sha, "author", filename, complexity, 100.0, 0.5, "2024-01-01 10:00:00"
+
+
+def test_batch_writer_flushes_in_chunks(db):
+    with db.CommitAnalysisWriter(batch_size=3) as writer:
+        for i in range(7):
+            writer.add(*_analysis_row(f"sha{i}", "main.py"))
+
+    assert writer.rows_written == 7
+    assert writer.flushes == 3
+    assert len(db.getRepoAnalysis("owner", "repo")) == 7
+
+
+def test_batch_writer_upserts_existing_rows(db):
+    db.insert_commit_complexity_batch([_analysis_row("sha1", "main.py", 1)])
+    db.insert_commit_complexity_batch([_analysis_row("sha1", "main.py", 5)])
+
+    analysis = db.getRepoAnalysis("owner", "repo")
+    assert len(analysis) == 1
+    assert analysis[0][5] == 5
+
+
+def test_migrations_are_recorded_once(db):
+    with db.db_connection() as (conn, cursor):
+        assert db.migrations.migrate(conn) == db.migrations.LATEST_VERSION
+        versions = cursor.execute("SELECT version FROM schema_version ORDER BY version").fetchall()
+
+    assert [v[0] for v in versions] == [m[0] for m in db.migrations.MIGRATIONS]
+
+
+def _query_plan(cursor, query, params):
+    return [row[3] for row in cursor.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()]
+
+
+@pytest.mark.parametrize("name", sorted(name for name in dir(database) if name.endswith("_QUERY")))
+def test_queries_use_indexes(db, name):
+    query = getattr(db, name).format(orderBy="complexity")
+    params = (None,) * query.count("?")
+
+    with db.db_connection() as (conn, cursor):
+        plan = _query_plan(cursor, query, params)
+
+    table_steps = [step for step in plan if "TEMP B-TREE" not in step]
+    assert table_steps, plan
+    for step in table_steps:
+        assert step.startswith("SEARCH"), plan
+        assert "INDEX" in step or "INTEGER PRIMARY KEY" in step, plan
+
+
+def test_analysis_queries_use_repo_indexes(db):
+    with db.db_connection() as (conn, cursor):
+        overview_plan = _query_plan(cursor, db.REPO_ANALYSIS_QUERY.format(orderBy="complexity"), ("r", "o"))
+        report_plan = _query_plan(cursor, db.CONTRIBUTOR_ANALYSIS_QUERY, ("r", "o", "a"))
+
+    assert any("idx_analysis_repo_complexity" in step for step in overview_plan)
+    assert not any("ORDER BY" in step for step in overview_plan)
+    assert any("contributorMonthly" in step and "author=?" in step for step in report_plan)
+    assert any("contributorDaily" in step and "day>? AND day<?" in step for step in report_plan)
+
+
+def test_analysis_pages_follow_keyset_cursors(db):
+    rows = [_analysis_row(f"sha{i}", f"src/file{i}.py", complexity) for i, complexity in
+            enumerate([5, 50, 15, 15, None, 30, 15])]
+    db.insert_commit_complexity_batch(rows)
+
+    seen = []
+    cursor = None
+    while True:
+        page, cursor = db.get_repo_analysis_page("owner", "repo", limit=2, cursor=cursor)
+        seen += [row[5] for row in page]
+        if cursor is None:
+            break
+
+    assert seen == [50, 30, 15, 15, 15, 5, None]
+
+
+def test_analysis_pages_apply_filters(db):
+    db.insert_commit_complexity_batch([
+        _analysis_row("sha1", "src/app.py", 12),
+        _analysis_row("sha2", "tests/test_app.py", 14),
+        _analysis_row("sha3", "src/util.py", 3),
+    ])
+
+    page, cursor = db.get_repo_analysis_page("owner", "repo", filename_prefix="src/", grade="B")
+
+    assert [row[4] for row in page] == ["src/app.py"]
+    assert cursor is None
+    with pytest.raises(HTTPException):
+        db.get_repo_analysis_page("owner", "repo", sort="complexity; DROP TABLE users")
+    with pytest.raises(HTTPException):
+        db.getRepoAnalysis("owner", "repo", orderBy="complexity; DROP TABLE users")
+
+
+@pytest.mark.parametrize("sort", ["complexity", "maintainability", "commentRatio", "date"])
+def test_analysis_page_sorts_use_indexes(db, sort):
+    column = db.ANALYSIS_SORT_COLUMNS[sort]
+    first_page = db.analysis_page_queries("o", "r", 10, sort=sort)
+    deep_page = db.analysis_page_queries("o", "r", 10, db.encode_analysis_cursor(sort, 1, 1), sort)
+    null_tail = db.analysis_page_queries("o", "r", 10, db.encode_analysis_cursor(sort, None, 1), sort)
+
+    with db.db_connection() as (conn, cursor):
+        plans = [_query_plan(cursor, query, params) for query, params in first_page + deep_page + null_tail]
+
+    for plan in plans:
+        assert any(step.startswith("SEARCH") and "INDEX" in step for step in plan), plan
+        assert not any("TEMP B-TREE" in step for step in plan), plan
+    # past the cursor the sort column is part of the index range, so deep pages don't filter every earlier row
+    assert any(f"{column}<?" in step for step in plans[1]), plans[1]
+    assert any(f"{column}=?" in step for step in plans[3]), plans[3]
+
+
+def test_sql_grades_match_python_grades(db):
+    values = [i / 4 for i in range(0, 400)] + [i / 100 for i in range(0, 100)]
+    with db.db_connection() as (conn, cursor):
+        for value in values:
+            complexity, maintainability, comment = cursor.execute(
+                f"SELECT {db.complexity_grade_sql('?1')}, {db.maintainability_grade_sql('?1')}, "
+                f"{db.comment_ratio_grade_sql('?1')}", (value,)).fetchone()
+
+            assert complexity == utils.grade_complexity(value)[1], value
+            assert maintainability == utils.grade_maintainability(value)[0], value
+            assert comment == utils.grade_comment_ratio(value)[0], value
+
+
+def test_analysis_summary_grades_whole_repository(db):
+    assert db.get_repo_analysis_summary("owner", "repo")["complexity_grade"] == "A"
+
+    db.insert_commit_complexity_batch([
+        _analysis_row("sha1", "a.py", 5),
+        _analysis_row("sha2", "b.py", 15),
+        _analysis_row("sha3", "c.py", 50),
+        _analysis_row("sha4", "d.py", None),
+    ])
+    summary = db.get_repo_analysis_summary("owner", "repo")
+
+    assert summary["files"] == 4
+    assert summary["avg_complexity"] == round(70 / 3, 2)
+    assert summary["complexity_grade"] == utils.grade_complexity(summary["avg_complexity"])[1]
+    assert (summary["complexity_a"], summary["complexity_b"], summary["complexity_c"],
+            summary["complexity_f"]) == (1, 1, 0, 1)
+    assert summary["maintainability_f"] == 4
+    page, _ = db.get_repo_analysis_page("owner", "repo")
+    assert [row[10] for row in page] == ["F", "B", "A", None]
+
+
+def test_repo_summary_tracks_upserts_and_deletes(db):
+    db.insert_commit_complexity_batch([_analysis_row("sha1", "a.py", 5), _analysis_row("sha2", "b.py", 50)])
+    db.insert_commit_complexity_batch([_analysis_row("sha2", "b.py", 15)])
+    with db.db_connection() as (conn, cursor):
+        cursor.execute("DELETE FROM commitFileAnalysis WHERE commit_sha='sha1'")
+        cursor.execute("INSERT INTO commitFileAnalysis VALUES ('owner', 'other', 'x', 'a', 'c.py', 99, 1, 1, NULL)")
+
+    incremental = db.get_repo_analysis_summary("owner", "repo")
+    assert incremental["files"] == 1
+    assert incremental["avg_complexity"] == 15
+    assert (incremental["complexity_a"], incremental["complexity_b"], incremental["complexity_f"]) == (0, 1, 0)
+
+    with db.db_connection() as (conn, cursor):
+        cursor.execute("DELETE FROM repoSummary")
+    db.rebuild_summaries()
+    assert db.get_repo_analysis_summary("owner", "repo") == incremental
+    assert db.get_repo_analysis_summary("owner", "other")["complexity_f"] == 1
+
+
+def test_contributor_rollups_count_distinct_commits(db):
+    db.insert_commit_complexity_batch([
+        ("owner", "repo", "sha1", "author", "a.py", 4, 80.0, 0.2, "2024-01-03 10:00:00"),
+        ("owner", "repo", "sha1", "author", "b.py", 8, 60.0, 0.4, "2024-01-03 10:00:00"),
+        ("owner", "repo", "sha2", "author", "a.py", 6, None, 0.6, "2024-01-20 10:00:00"),
+        ("owner", "repo", "sha3", "author", "a.py", 30, 40.0, 0.1, "2024-02-01 10:00:00"),
+        ("owner", "repo", "sha4", "other", "a.py", 1, 1.0, 1.0, "2024-02-01 10:00:00"),
+    ])
+    # re-analysing a file must not count its commit twice
+    db.insert_commit_complexity_batch([("owner", "repo", "sha1", "author", "a.py", 2, 80.0, 0.2, "2024-01-03 10:00:00")])
+    with db.db_connection() as (conn, cursor):
+        cursor.execute("DELETE FROM commitFileAnalysis WHERE commit_sha='sha3'")
+
+    assert db.get_repo_contributor_data("owner", "repo", "author") == [("2024-01-03", 1), ("2024-01-20", 1)]
+    (month,) = db.get_repo_contributor_analysis("owner", "repo", "author")
+    assert month == ("2024-01-20", 70.0, pytest.approx(0.4), pytest.approx(16 / 3))
+
+
+def test_contributor_trigger_lookups_seek_on_the_commit(db):
+    # the per-write identity lookup of the contributorDaily triggers, with NEW's values as parameters
+    templates = rollups.CONTRIBUTOR_DAILY.distinct[1]
+    query = "SELECT COUNT(*) FROM commitFileAnalysis WHERE " + " AND ".join(
+        f"{template.format(row='commitFileAnalysis')} IS ?" for template in templates)
+
+    with db.db_connection() as (conn, cursor):
+        plan = _query_plan(cursor, query, ("sha", "o", "r", "a", "2024-01-01"))
+
+    assert any(step.startswith("SEARCH") and "commit_sha=?" in step for step in plan), plan
+
+
+def test_git_tokens_are_cached_until_changed(db, monkeypatch):
+    monkeypatch.setattr(utils, "_fernet", utils.Fernet(utils.Fernet.generate_key()))
+    db.git_token_cache.clear()
+    assert db.getGitToken(7) is None
+
+    assert db.storeGitToken("gho_first", 7)
+    assert db.getGitToken(7) == "gho_first"
+
+    # served from the cache without touching the database
+    with db.db_connection() as (conn, cursor):
+        cursor.execute("UPDATE githubTokens SET token=? WHERE user_id=7", (utils.encryptToken("gho_other"),))
+    assert db.getGitToken(7) == "gho_first"
+
+    db.removeGitHubToken(7)
+    assert db.getGitToken(7) is None
+
+
+def test_ttl_cache_expires_and_bounds_entries(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(utils.time, "monotonic", lambda: now[0])
+    cache = utils.TTLCache(ttl=10, max_entries=2)
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (None, 2, 3)
+
+    now[0] += 10
+    assert cache.get("b", "expired") == "expired"
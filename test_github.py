@@ -0,0 +1,597 @@
+import asyncio
+import os
+import subprocess
+from contextlib import aclosing
+import httpx
+import pytest
+from fastapi import HTTPException
+import database
+from github import github_api, commit_store, repos_cache, github_routes
+from models import CommitDetails
+from github.github_client import GitHubClient
+
+
+def _commit_payload(sha):
+    return {
+        "sha": sha,
+        "commit": {"author": {"name": "author", "date": "2024-01-01T10:00:00Z"}, "message": "message"},
+        "stats": {"total": 1, "additions": 1, "deletions": 0},
+        "files": [{"filename": "main.py", "status": "modified", "additions": 1, "deletions": 0, "changes": 1,
+                   "patch": "+x = 1"}],
+    }
+
+
+@pytest.fixture(autouse=True)
+def db(tmp_path):
+    database.init_pool(str(tmp_path / "test.db"))
+    database.create_db()
+    yield database
+    database.close_pool()
+
+
+async def _collect(generator):
+    return [item async for item in generator]
+
+
+def test_commit_details_are_fetched_concurrently_with_a_limit():
+    in_flight = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        sha = request.url.path.rsplit("/", 1)[-1]
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
+        if sha == "bad":
+            return httpx.Response(404, json={"message": "Not Found"})
+        return httpx.Response(200, json=_commit_payload(sha))
+
+    async def run():
+        client = GitHubClient(transport=httpx.MockTransport(handler))
+        shas = [f"sha{i}" for i in range(10)] + ["bad"]
+        fetched = github_api.fetch_commit_details_concurrently(shas, "owner", "repo", "token", concurrency=3,
+                                                                  client=client)
+        results = await _collect(fetched)
+        await client.aclose()
+        return results
+
+    results = dict(asyncio.run(run()))
+
+    assert peak == 3
+    assert len(results) == 11
+    assert all(results[f"sha{i}"].sha == f"sha{i}" for i in range(10))
+    assert results["bad"].status_code == 404
+
+
+def test_github_client_sends_default_and_auth_headers():
+    seen = {}
+
+    def handler(request):
+        seen.update(request.headers)
+        seen["url"] = str(request.url)
+        return httpx.Response(200, json={})
+
+    async def run():
+        client = GitHubClient(transport=httpx.MockTransport(handler))
+        await client.get("/user/repos", "token")
+        await client.aclose()
+
+    asyncio.run(run())
+
+    assert seen["url"] == "https://api.github.com/user/repos"
+    assert seen["authorization"] == "Bearer token"
+    assert seen["accept"] == "application/vnd.github+json"
+
+
+def test_paginate_fetches_remaining_pages_concurrently_in_order():
+    requested = []
+
+    def handler(request):
+        page = int(request.url.params.get("page", 1))
+        requested.append(page)
+        headers = {}
+        if page == 1:
+            headers["Link"] = ('<https://api.github.com/user/repos?per_page=2&page=2>; rel="next", '
+                               '<https://api.github.com/user/repos?per_page=2&page=4>; rel="last"')
+        return httpx.Response(200, json=[page * 10, page * 10 + 1], headers=headers)
+
+    async def run():
+        client = GitHubClient(transport=httpx.MockTransport(handler))
+        items = await _collect(github_api.paginate("/user/repos", "token", {"per_page": 2}, client=client))
+        await client.aclose()
+        return items
+
+    assert asyncio.run(run()) == [10, 11, 20, 21, 30, 31, 40, 41]
+    assert sorted(requested) == [1, 2, 3, 4]
+
+
+def test_paginate_settles_in_flight_pages_when_a_page_fails():
+    async def handler(request):
+        page = int(request.url.params.get("page", 1))
+        headers = {}
+        if page == 1:
+            headers["Link"] = '<https://api.github.com/user/repos?per_page=2&page=6>; rel="last"'
+        elif page == 2:
+            return httpx.Response(500, json={"message": "Server Error"})
+        else:
+            # still downloading when page 2 fails
+            await asyncio.sleep(1)
+        return httpx.Response(200, json=[page], headers=headers)
+
+    async def run():
+        client = GitHubClient(transport=httpx.MockTransport(handler))
+        try:
+            with pytest.raises(HTTPException):
+                await _collect(github_api.paginate("/user/repos", "token", {"per_page": 2}, client=client))
+            leftover = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            assert leftover == []
+        finally:
+            await client.aclose()
+
+    asyncio.run(run())
+
+
+def test_commit_fetching_starts_from_an_async_listing():
+    def handler(request):
+        return httpx.Response(200, json=_commit_payload(request.url.path.rsplit("/", 1)[-1]))
+
+    async def listing():
+        for i in range(5):
+            yield f"sha{i}"
+        raise RuntimeError("listing failed")
+
+    async def run():
+        client = GitHubClient(transport=httpx.MockTransport(handler))
+        fetched = github_api.fetch_commit_details_concurrently(listing(), "owner", "repo", "token", client=client)
+        try:
+            return await _collect(fetched)
+        finally:
+            await client.aclose()
+
+    with pytest.raises(RuntimeError, match="listing failed"):
+        asyncio.run(run())
+
+
+def test_consumer_error_propagates_and_cancels_pending_fetches():
+    def handler(request):
+        sha = request.url.path.rsplit("/", 1)[-1]
+        if sha == "sha0":
+            return httpx.Response(500, json={"message": "Server Error"})
+        return httpx.Response(200, json=_commit_payload(sha))
+
+    async def run():
+        client = GitHubClient(transport=httpx.MockTransport(handler))
+        shas = ["sha0"] + [f"sha{i}" for i in range(1, 20)]
+        fetched = github_api.fetch_commit_details_concurrently(shas, "owner", "repo", "token", concurrency=2,
+                                                                  client=client)
+        try:
+            # the consumer re-raises a failed commit and closes the generator early, as api_commits does
+            async with aclosing(fetched):
+                async for sha, commitChanges in fetched:
+                    if isinstance(commitChanges, Exception):
+                        raise commitChanges
+        finally:
+            await client.aclose()
+            leftover = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            assert leftover == []
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(run())
+    assert error.value.status_code == 500
+
+
+def test_get_cached_revalidates_with_etag():
+    conditional_headers = []
+
+    def handler(request):
+        conditional_headers.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304, headers={"ETag": '"v1"'})
+        link = '<https://api.github.com/repos/owner/repo?page=2>; rel="next"'
+        return httpx.Response(200, json={"full_name": "owner/repo"}, headers={"ETag": '"v1"', "Link": link})
+
+    async def run():
+        client = GitHubClient(transport=httpx.MockTransport(handler))
+        first = await client.get_cached("/repos/owner/repo", "token", "1")
+        second = await client.get_cached("/repos/owner/repo", "token", "1")
+        await client.aclose()
+        return client, first, second
+
+    client, first, second = asyncio.run(run())
+
+    assert conditional_headers == [None, '"v1"']
+    assert first.json() == second.json() == {"full_name": "owner/repo"}
+    assert second.status_code == 200
+    # headers the 304 doesn't carry are replayed from the cache, so pagination still sees every page
+    assert second.headers["Link"] == first.headers["Link"]
+    assert second.headers["Content-Type"] == "application/json"
+    assert client.cache_stats() == {"hits": 1, "misses": 1, "revalidations": 1}
+
+
+def test_commit_store_round_trips_and_evicts(monkeypatch):
+    monkeypatch.setattr(commit_store, "_stored_bytes", None)
+
+    details = CommitDetails(**_commit_payload("sha1"))
+    commit_store.save_commit_details("owner", "repo", details)
+    assert commit_store.load_commit_details("owner", "repo", "sha1") == details
+    assert commit_store.load_commit_details("owner", "repo", "missing") is None
+
+    entry_size = database.get_commit_details_store_size()[1]
+    monkeypatch.setattr(commit_store, "COMMIT_STORE_MAX_BYTES", entry_size + entry_size // 2)
+    commit_store.save_commit_details("owner", "repo", CommitDetails(**_commit_payload("sha2")))
+
+    assert commit_store.load_commit_details("owner", "repo", "sha1") is None
+    assert commit_store.load_commit_details("owner", "repo", "sha2") is not None
+
+
+def test_rate_limited_requests_are_retried_after_backoff(monkeypatch):
+    from github import rate_limit
+    monkeypatch.setattr(rate_limit.random, "uniform", lambda a, b: a)
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0.05"})
+        return httpx.Response(200, json={}, headers={"X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": "2500",
+                                                     "X-RateLimit-Reset": "0"})
+
+    async def run():
+        client = GitHubClient(transport=httpx.MockTransport(handler))
+        response = await client.get("/user/repos", "token")
+        await client.aclose()
+        return client, response
+
+    client, response = asyncio.run(run())
+    status = client.rate_limit_status("token")
+
+    assert response.status_code == 200
+    assert len(calls) == 2
+    assert status["remaining"] == 2500
+    assert status["throttled"] == 1
+    assert status["concurrency"] == rate_limit.GITHUB_MAX_CONCURRENCY // 2
+
+
+def test_token_scheduler_waits_for_reset_when_budget_is_spent():
+    import time
+    from github.rate_limit import TokenScheduler
+
+    async def run():
+        scheduler = TokenScheduler(max_concurrency=4, reserve=0)
+        scheduler.update({"X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": "0",
+                          "X-RateLimit-Reset": str(time.time() + 0.1)})
+        started = time.perf_counter()
+        await scheduler.acquire()
+        waited = time.perf_counter() - started
+        await scheduler.release()
+        return waited
+
+    assert asyncio.run(run()) >= 0.09
+
+
+def test_repos_cache_serves_stale_entries_while_revalidating(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(repos_cache.time, "monotonic", lambda: now[0])
+    loads = []
+
+    async def loader():
+        loads.append(now[0])
+        return len(loads)
+
+    async def scenario():
+        cache = repos_cache.StaleWhileRevalidateCache(ttl=10, stale_ttl=100)
+        first = await asyncio.gather(cache.get("user", loader), cache.get("user", loader))
+
+        now[0] += 50
+        stale = await cache.get("user", loader)
+        await asyncio.sleep(0)
+        refreshed = await cache.get("user", loader)
+
+        now[0] += 500
+        expired = await cache.get("user", loader)
+        return first, stale, refreshed, expired, cache.stats()
+
+    first, stale, refreshed, expired, stats = asyncio.run(scenario())
+    assert first == [1, 1]
+    assert (stale, refreshed, expired) == (1, 2, 3)
+    assert stats["stale"] == 1 and stats["misses"] == 3
+
+
+def test_language_colours_are_loaded_once_and_read_only():
+    colours = github_routes.load_language_colours()
+
+    assert github_routes.get_language_colour("Python") == colours["Python"]
+    assert github_routes.load_language_colours() is colours
+    with pytest.raises(TypeError):
+        colours["Python"] = "#000000"
+
+
+def test_issues_can_be_requested_in_compressed_columnar_form(monkeypatch):
+    from fastapi.testclient import TestClient
+    from main import app
+    from auth.auth_utils import auth_handler
+
+    monkeypatch.setattr(auth_handler, "secret", "test-secret")
+    database.insert_commit_complexity_batch([
+        ("owner", "repo", f"sha{i}", f"author{i % 2}", f"src/file{i % 3}.py", i, 50.0 + i, 0.2, "2024-01-01 10:00:00")
+        for i in range(60)])
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {auth_handler.encodeToken(1)}", "Accept-Encoding": "gzip"}
+    params = {"repoOwner": "owner", "repoName": "repo", "limit": 50}
+
+    rows = client.get("/github/issues", params=params, headers=headers)
+    columnar = client.get("/github/issues", params={**params, "format": "columnar"}, headers=headers)
+
+    assert columnar.headers["Content-Encoding"] == "gzip"
+    assert columnar.headers["X-Next-Cursor"] == rows.headers["X-Next-Cursor"]
+    cross_origin = client.get("/github/issues", params=params, headers={**headers, "Origin": "https://app.example"})
+    assert "X-Next-Cursor" in cross_origin.headers["Access-Control-Expose-Headers"]
+    body = columnar.json()
+    columns = {name: values for name, values in zip(body["columns"], body["values"])}
+    for position, row in enumerate(rows.json()):
+        assert body["dictionaries"]["author"][columns["author"][position]] == row["author"]
+        assert body["dictionaries"]["fileName"][columns["fileName"][position]] == row["fileName"]
+        assert columns["complexity"][position] == row["complexity"]
+        assert body["gradeClasses"][columns["grade"][position]] == row["gradeClass"]
+    assert len(body["dictionaries"]["fileName"]) == 3
+
+
+def test_stored_commits_are_only_served_to_users_who_can_see_the_repository(monkeypatch):
+    from fastapi.testclient import TestClient
+    from main import app
+    from auth.auth_utils import auth_handler
+    from github import github_client
+
+    requested = []
+
+    def handler(request):
+        requested.append((request.headers["Authorization"], request.url.path))
+        if request.headers["Authorization"] == "Bearer outsider-token":
+            return httpx.Response(404, json={"message": "Not Found"})
+        return httpx.Response(200, json={"full_name": "owner/private"}, headers={"ETag": '"v1"'})
+
+    monkeypatch.setattr(auth_handler, "secret", "test-secret")
+    monkeypatch.setattr(github_routes, "getGitToken", {"1": "member-token", "3": "outsider-token"}.get)
+    commit_store.save_commit_details("owner", "private", CommitDetails(**_commit_payload("abc")))
+    client = TestClient(app)
+    github_client.start_github_client(httpx.MockTransport(handler))
+    params = {"sha": "abc", "repoOwner": "owner", "repoName": "private", "filename": "main.py"}
+
+    def get_file(user):
+        return client.get("/github/commit/changes/file", params=params,
+                          headers={"Authorization": f"Bearer {auth_handler.encodeToken(user)}"})
+
+    try:
+        member, unconnected, outsider = get_file(1), get_file(2), get_file(3)
+    finally:
+        asyncio.run(github_client.close_github_client())
+
+    assert member.status_code == 200
+    assert member.json()["patch"] == "+x = 1"
+    assert unconnected.status_code == 400
+    assert outsider.status_code == 404
+    # the commit itself came from the store; GitHub was only asked whether each caller can see the repository
+    assert {path for _, path in requested} == {"/repos/owner/private"}
+
+
+def test_response_encoding_negotiation(monkeypatch):
+    import responses
+
+    monkeypatch.setattr(responses, "brotli", None)
+    assert responses.negotiate_encoding("gzip, deflate, br") == "gzip"
+    assert responses.negotiate_encoding("gzip;q=0, identity") is None
+    assert responses.negotiate_encoding("*") == "gzip"
+    assert responses.negotiate_encoding("") is None
+
+    monkeypatch.setattr(responses, "brotli", object())
+    assert responses.negotiate_encoding("gzip, br") == "br"
+    assert responses.negotiate_encoding("gzip, br;q=0.5") == "gzip"
+
+
+def test_repository_updates_resume_from_the_branch_watermark(monkeypatch):
+    from analysis_pool import AnalysisExecutor
+    from github import repo_update
+    from github.github_client import start_github_client, close_github_client
+
+    history = {"main": ["c1", "c2"]}
+    downloaded = []
+    compared = []
+
+    def handler(request):
+        path = request.url.path
+        if path == "/repos/owner/repo":
+            return httpx.Response(200, json={"default_branch": "main"})
+        if path == "/repos/owner/repo/branches/main":
+            return httpx.Response(200, json={"commit": {"sha": history["main"][-1]}})
+        if path == "/repos/owner/repo/commits":
+            return httpx.Response(200, json=[{"sha": sha} for sha in reversed(history["main"])])
+        if path.startswith("/repos/owner/repo/compare/"):
+            base, head = path.rsplit("/", 1)[-1].split("...")
+            compared.append(base)
+            commits = history["main"][history["main"].index(base) + 1:history["main"].index(head) + 1]
+            return httpx.Response(200, json={"commits": [{"sha": sha} for sha in commits]})
+        sha = path.rsplit("/", 1)[-1]
+        downloaded.append(sha)
+        return httpx.Response(200, json=_commit_payload(sha))
+
+    async def update():
+        start_github_client(httpx.MockTransport(handler))
+        try:
+            return [event async for event in repo_update.update_repository("owner", "repo", "1")]
+        finally:
+            await close_github_client()
+
+    monkeypatch.setattr(repo_update, "getGitToken", lambda user_id: "token")
+    monkeypatch.setattr(repo_update, "get_analysis_executor", lambda: AnalysisExecutor(workers=0))
+
+    asyncio.run(update())
+    asyncio.run(update())
+    assert sorted(downloaded) == ["c1", "c2"]
+    assert compared == []
+
+    # a new commit, plus one that was already analysed elsewhere, arrive on the branch
+    history["main"] += ["c3", "c4"]
+    with database.CommitAnalysisWriter() as writer:
+        writer.mark_seen("owner", "repo", "c3")
+    asyncio.run(update())
+
+    assert sorted(downloaded) == ["c1", "c2", "c4"]
+    assert compared == ["c2"]
+    assert database.get_sync_watermark("owner", "repo", "main") == "c4"
+    assert database.get_seen_commits("owner", "repo") == {"c1", "c2", "c3", "c4"}
+
+
+def _git(repo, *args):
+    subprocess.run(["git", "-C", str(repo), "-c", "user.name=Ada", "-c", "user.email=ada@example.com", *args],
+                   check=True, capture_output=True, env={**os.environ, "GIT_AUTHOR_DATE": "2024-01-02T03:04:05+02:00",
+                                                         "GIT_COMMITTER_DATE": "2024-01-02T03:04:05+02:00"})
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    # a local "GitHub": <tmp>/remote/owner/repo.git, served to the mirror backend by path
+    from github import git_mirror
+
+    work = tmp_path / "work"
+    work.mkdir()
+    _git(work, "init", "--quiet", "--initial-branch=main")
+    (work / "app.py").write_text("def main():\n    return 1\n")
+    (work / "notes.txt").write_text("notes\n")
+    _git(work, "add", ".")
+    _git(work, "commit", "--quiet", "-m", "first")
+
+    bare = tmp_path / "remote" / "owner" / "repo.git"
+    subprocess.run(["git", "clone", "--bare", "--quiet", str(work), str(bare)], check=True)
+    _git(work, "remote", "add", "origin", str(bare))
+
+    monkeypatch.setattr(git_mirror, "GITHUB_GIT_URL", str(tmp_path / "remote"))
+    monkeypatch.setattr(git_mirror, "GIT_MIRROR_DIR", str(tmp_path / "mirrors"))
+    return work
+
+
+def test_git_log_is_streamed_as_github_style_patches(remote):
+    from github import git_mirror
+
+    (remote / "app.py").write_text("def main():\n    if True:\n        return 2\n")
+    (remote / "logo.bin").write_bytes(b"\x00\x01binary")
+    (remote / "my file.py").write_text("x = 1\n")
+    _git(remote, "rm", "--quiet", "notes.txt")
+    _git(remote, "add", ".")
+    _git(remote, "commit", "--quiet", "-m", "second")
+    _git(remote, "push", "--quiet", "origin", "main")
+
+    async def run():
+        path = await git_mirror.update_mirror("owner", "repo")
+        branch, head = await git_mirror.resolve_branch(path)
+        return branch, head, await _collect(git_mirror.iter_commit_patches(path, head))
+
+    branch, head, commits = asyncio.run(run())
+
+    assert branch == "main"
+    assert [commit.sha for commit in commits][0] == head
+    assert commits[0].author == ("Ada", "2024-01-02T01:04:05Z")
+    files = {file.filename: file.patch for file in commits[0].files}
+    assert files["app.py"].startswith("@@ -1,2 +1,3 @@")
+    assert "+        return 2" in files["app.py"].split("\n")
+    assert files["logo.bin"] is None
+    assert files["my file.py"] == "@@ -0,0 +1 @@\n+x = 1"
+    assert files["notes.txt"] == "@@ -1 +0,0 @@\n-notes"
+    assert {file.filename for file in commits[1].files} == {"app.py", "notes.txt"}
+
+
+def test_mirrors_fetch_only_branches(remote, tmp_path, monkeypatch):
+    from github import git_mirror
+
+    bare = tmp_path / "remote" / "owner" / "repo.git"
+    # a file:// url makes git negotiate objects as it would with GitHub instead of copying the whole object store
+    monkeypatch.setattr(git_mirror, "GITHUB_GIT_URL", (tmp_path / "remote").as_uri())
+    # a pull request head that is on no branch, as GitHub publishes under refs/pull
+    _git(remote, "checkout", "--quiet", "-b", "feature")
+    (remote / "feature.py").write_text("x = 1\n")
+    _git(remote, "add", ".")
+    _git(remote, "commit", "--quiet", "-m", "feature")
+    _git(remote, "push", "--quiet", "origin", "feature:refs/pull/1/head")
+    pull_head = subprocess.run(["git", "-C", str(remote), "rev-parse", "HEAD"], capture_output=True, text=True,
+                               check=True).stdout.strip()
+    _git(remote, "checkout", "--quiet", "main")
+
+    async def run():
+        path = await git_mirror.update_mirror("owner", "repo")
+        _git(remote, "commit", "--quiet", "--allow-empty", "-m", "second")
+        _git(remote, "push", "--quiet", "origin", "main")
+        await git_mirror.update_mirror("owner", "repo")
+        return path, await git_mirror.has_commit(path, pull_head), await git_mirror.resolve_branch(path)
+
+    path, has_pull_head, (branch, head) = asyncio.run(run())
+    refs = subprocess.run(["git", "-C", path, "for-each-ref", "--format=%(refname)"], capture_output=True, text=True,
+                          check=True).stdout.split()
+
+    assert refs == ["refs/heads/main"]
+    assert not has_pull_head
+    assert head == subprocess.run(["git", "-C", str(bare), "rev-parse", "main"], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+
+
+def test_git_token_is_passed_in_the_environment_not_argv(monkeypatch):
+    import base64
+    from github import git_mirror
+
+    argv = []
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def spy(*args, **kwargs):
+        argv.extend(args)
+        return await create_subprocess_exec(*args, **kwargs)
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", spy)
+    header = asyncio.run(git_mirror._git("config", "--get", "http.extraHeader", token="secret-token"))
+
+    credentials = base64.b64encode(b"x-access-token:secret-token").decode()
+    assert header == f"Authorization: Basic {credentials}"
+    assert not any(credentials in arg or "secret-token" in arg for arg in argv)
+
+
+@pytest.mark.parametrize("repoOwner, repoName", [("..", "repo"), ("owner", ".."), ("owner", "."),
+                                                   ("own/er", "repo"), ("owner", "re/po"), ("-owner", "repo")])
+def test_mirror_paths_refuse_names_outside_githubs_charset(tmp_path, monkeypatch, repoOwner, repoName):
+    from github import git_mirror
+
+    monkeypatch.setattr(git_mirror, "GIT_MIRROR_DIR", str(tmp_path / "mirrors"))
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(git_mirror.update_mirror(repoOwner, repoName))
+    assert error.value.status_code == 400
+    assert not (tmp_path / "mirrors").exists()
+
+
+def test_git_backend_analyses_only_new_commits(remote, monkeypatch):
+    from analysis_pool import AnalysisExecutor
+    from github import repo_update
+
+    monkeypatch.setattr(repo_update, "getGitToken", lambda user_id: "token")
+    monkeypatch.setattr(repo_update, "get_analysis_executor", lambda: AnalysisExecutor(workers=0))
+    monkeypatch.setattr(github_api, "fetch_commit_details", None)
+
+    def update():
+        async def run():
+            return [event async for event in repo_update.update_repository("owner", "repo", "1", backend="git")]
+        return asyncio.run(run())
+
+    update()
+    assert update()[-1]["commits"] == 0
+
+    (remote / "app.py").write_text("def main():\n    return 3\n")
+    _git(remote, "commit", "--quiet", "-am", "third")
+    _git(remote, "push", "--quiet", "origin", "main")
+    events = update()
+
+    assert events[-2]["commits"] == 1
+    assert len(database.get_seen_commits("owner", "repo")) == 2
+    assert len(database.getRepoAnalysis("owner", "repo")) == 2
+    # metrics describe the whole repository, not just the one commit this run analysed
+    summary = database.get_repo_analysis_summary("owner", "repo")
+    assert events[-1]["event"] == "metrics"
+    assert events[-1]["fileCount"] == 2
+    assert events[-1]["averageComplexity"] == summary["avg_complexity"]
@@ -0,0 +1,109 @@
+import asyncio
+from github.jobs import JobManager, DONE, FAILED
+
+
+def test_second_submit_for_a_repo_attaches_to_the_running_job():
+    runs = []
+
+    async def runner(repoOwner, repoName, user_id):
+        runs.append((repoOwner, repoName))
+        await asyncio.sleep(0.01)
+        yield {"event": "progress", "commits": 3, "files": 4, "rows": 2}
+
+    async def run():
+        manager = JobManager(runner)
+        first, created_first = manager.submit("Owner", "Repo", "1")
+        second, created_second = manager.submit("owner", "repo", "2")
+        other, _ = manager.submit("owner", "other", "1")
+        await asyncio.gather(manager.wait(first), manager.wait(other))
+        third, created_third = manager.submit("owner", "repo", "1")
+        await manager.wait(third)
+        return first, second, third, created_first, created_second, created_third
+
+    first, second, third, created_first, created_second, created_third = asyncio.run(run())
+
+    assert first is second
+    assert (created_first, created_second, created_third) == (True, False, True)
+    assert third is not first
+    assert runs == [("Owner", "Repo"), ("owner", "other"), ("owner", "repo")]
+    assert first.status == DONE
+    assert first.to_dict()["commits"] == 3
+    assert first.to_dict()["runSeconds"] >= 0.01
+
+
+def test_failed_jobs_record_their_error():
+    async def runner(repoOwner, repoName, user_id):
+        raise RuntimeError("GitHub API request failed")
+        yield
+
+    async def run():
+        manager = JobManager(runner)
+        job, _ = manager.submit("owner", "repo", "1")
+        await manager.wait(job)
+        return manager, job
+
+    manager, job = asyncio.run(run())
+
+    assert job.status == FAILED
+    assert job.error == "GitHub API request failed"
+    assert manager.get(job.id) is job
+    assert manager.active_job("owner", "repo") is None
+
+
+def test_job_events_stream_progress_until_the_job_finishes():
+    release = None
+
+    async def runner(repoOwner, repoName, user_id):
+        yield {"event": "progress", "commits": 1, "files": 2, "rows": 0}
+        await release.wait()
+        yield {"event": "metrics", "averageComplexity": 4.5}
+        yield {"event": "progress", "commits": 2, "files": 5, "rows": 5}
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        manager = JobManager(runner)
+        job, _ = manager.submit("owner", "repo", "1")
+        await asyncio.sleep(0)
+
+        events = []
+        async for event in job.events(heartbeat=0.01):
+            events.append(event)
+            if event is None:
+                release.set()
+
+        late = [event async for event in job.events()]
+        return job, events, late
+
+    job, events, late = asyncio.run(run())
+    names = [event["event"] if event else None for event in events]
+
+    assert names[0] == "status"
+    assert None in names
+    assert names[-3:] == ["metrics", "progress", DONE]
+    assert events[-1]["rows"] == 5
+    assert [event["event"] for event in late] == ["status", "metrics", DONE]
+    assert job.metrics == {"averageComplexity": 4.5}
+
+
+def test_jobs_finish_when_the_runner_raises_a_base_exception():
+    async def runner(repoOwner, repoName, user_id):
+        yield {"event": "progress", "commits": 1, "files": 1, "rows": 0}
+        raise BaseExceptionGroup("unhandled errors in a TaskGroup", [GeneratorExit()])
+
+    async def run():
+        manager = JobManager(runner)
+        job, _ = manager.submit("owner", "repo", "1")
+        events = job.events(heartbeat=0.01)
+        first = await anext(events)
+        streamed = [first] + [event async for event in events if event is not None]
+        await manager.wait(job)
+        return manager, job, streamed
+
+    manager, job, streamed = asyncio.run(run())
+
+    assert job.status == FAILED
+    assert "TaskGroup" in job.error
+    assert job.finished_at is not None
+    assert manager.active_job("owner", "repo") is None
+    assert [event["event"] for event in streamed] == ["status", "progress", FAILED]
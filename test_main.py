@@ -1,8 +1,13 @@
+import asyncio
+import threading
+import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 from unittest.mock import patch
 from main import app
 from models import User
 from auth.auth_utils import AuthHandler
+from auth.password_hasher import PasswordHasher
 import os
 
 client = TestClient(app)
@@ -80,3 +85,52 @@ def test_login_unsuccessful(mock_login):
         response = client.post("/auth/login", json=user_details)
 
         assert response.status_code == 401
+
+
+def test_verified_claims_are_cached_per_token():
+    handler = AuthHandler()
+    handler.secret = fake_jwt_token
+    token = handler.encodeToken(user_id)
+
+    assert handler.decodeToken(token) == str(user_id)
+    with patch('jwt.decode', side_effect=AssertionError("decoded twice")):
+        assert handler.decodeToken(token) == str(user_id)
+
+    forged = AuthHandler()
+    forged.secret = "another secret"
+    assert handler.decodeToken(forged.encodeToken(user_id), True) is False
+
+
+@patch('database.updatePasswordHash')
+@patch('database.login')
+def test_login_rehashes_passwords_with_a_different_cost(mock_login, mock_update):
+    with patch.dict(os.environ, {"JWT_SECRET": fake_jwt_token}):
+        weak_hash = auth_handler.pwd_context.handler("bcrypt").using(rounds=4).hash("password")
+        mock_login.return_value = (user_id, 'test@test.com', weak_hash, True)
+
+        response = client.post("/auth/login", json={"email": "test@test.com", "password": "password"})
+
+        assert response.status_code == 200
+        new_hash = mock_update.call_args.args[1]
+        assert mock_update.call_args.args[0] == user_id
+        assert auth_handler.verifyPassword("password", new_hash)
+        assert not auth_handler.pwd_context.needs_update(new_hash)
+
+
+def test_password_hasher_turns_away_excess_work():
+    async def scenario():
+        hasher = PasswordHasher(workers=1, max_pending=1)
+        release = threading.Event()
+        running = asyncio.create_task(hasher.run(release.wait))
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(HTTPException) as rejected:
+            await hasher.hash("password")
+        release.set()
+        await running
+        hasher.shutdown()
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"]
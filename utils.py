@@ -1,18 +1,66 @@
 from cryptography.fernet import Fernet
+from collections import OrderedDict
 import os
 import datetime
+import threading
+import time
+
+_fernet = None
+
+
+def get_fernet():
+    # built once per process from ENCRYPTION_KEY, instead of once per encrypt/decrypt
+    global _fernet
+    if _fernet is None:
+        _fernet = Fernet(os.getenv('ENCRYPTION_KEY'))
+    return _fernet
 
 
 def encryptToken(token: str):
-    key = os.getenv('ENCRYPTION_KEY')
-    f = Fernet(key)
-    return f.encrypt(token.encode())
+    return get_fernet().encrypt(token.encode())
 
 
 def decrypt_token(token: str):
-    key = os.getenv('ENCRYPTION_KEY')
-    f = Fernet(key)
-    return f.decrypt(token).decode()
+    return get_fernet().decrypt(token).decode()
+
+
+class TTLCache:
+    # Thread-safe mapping whose entries expire ttl seconds after being set (or after their own ttl); the least
+    # recently used entries are dropped once max_entries is reached.
+    def __init__(self, ttl: float, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
 
 
 def unix_to_timeStamp(unix_time):
@@ -21,6 +69,12 @@ def unix_to_timeStamp(unix_time):
     return converted_datetime
 
 
+# grade letter -> css class, shared by every metric's grades
+GRADE_CLASSES = {"A": "low", "B": "moderate", "C": "high", "F": "very-high"}
+COMPLEXITY_GRADE_TEXT = {"A": "low complexity", "B": "moderate complexity", "C": "high complexity",
+                         "F": "very high complexity"}
+
+
 def grade_complexity(complexity):
     if complexity <= 10:
         gradeText = "low complexity"